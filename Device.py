@@ -1,10 +1,12 @@
 import logging
+import random
+
+import numpy as np
 
 import LoraHelper
 import Packet
 import PositionHelper
 import TimeHelper
-import Transmission
 
 logger = logging.getLogger(__name__)
 
@@ -20,6 +22,10 @@ class Device:
     # numerator_cr:  The numerator value x of the coding rate x/3 in LoRa-E
     # hop_duration   The duration in ms of a frequency hop
     # hop_list:      The list of sequential frequencies to hop
+    # sim_map:       The map where the device is placed
+    # rng, py_rng:   The numpy and python random number generators of the simulation
+    # time_rng:      The numpy Generator of the transmission times of the device, drawn in blocks if given, one at a
+    #                time from rng and py_rng otherwise
     def __init__(
         self,
         device_id=None,
@@ -33,7 +39,11 @@ class Device:
         hop_list=None,
         num_rep_header=None,
         dr=None,
-        gateway=None
+        gateway=None,
+        sim_map=None,
+        rng=np.random,
+        py_rng=random,
+        time_rng=None
     ):
         assert id is not None
         self.next_time = 0
@@ -51,13 +61,15 @@ class Device:
         self.hop_list       = hop_list
         self.num_rep_header = num_rep_header
 
+        self.rng    = rng
+        self.py_rng = py_rng
+
         # Current frequency channel to use by the device
         self.position_hop_list = 0     
 
-        # The list of packets transmitted for frame traceability and metrics computation
-        self.pkt_list = []
-        # NOTE: pkt_list[i] NOT always returns pkt i, pkt number can be repeated if FHSS split
-
+        # The number of frames transmitted, the frames themselves are kept in the simulation frame table
+        self.num_frames = 0
+        # NOTE: frame number is the frame count when created, so it is repeated by all parts if FHSS split
 
         # Get the time in ms of a packet transmission
         (
@@ -79,8 +91,13 @@ class Device:
             # Set a correct transmission mode 
             self.time_mode = 'expo'
 
+        # Times of the transmissions drawn in blocks from the generator of the device
+        self.time_stream = None
+        if time_rng is not None:
+            self.time_stream = TimeHelper.TimeStream(self.tx_interval, self.time_mode, time_rng)
+
         # Get x, y position of the device in the map
-        self.pos_x, self.pos_y = PositionHelper.PositionHelper.get_position()
+        self.pos_x, self.pos_y = PositionHelper.PositionHelper.get_position(sim_map=sim_map, rng=self.rng)
 
         # Get the DR according to its distance to the gateway 
         if gateway and dr < 6:
@@ -93,21 +110,46 @@ class Device:
 
     # Returns number of frames created
     def get_num_frames(self):
-        return len(self.pkt_list)
-
-    # Adds a new packet to the node pkt list
-    def create_frame(self, current_time, duration):
-        frame = Packet.Frame(owner=self.device_id,
-                             number=self.get_num_frames(),
-                             duration=duration,
-                             modulation=self.modulation,
-                             start_time=current_time)
-        self.pkt_list.append(frame)
-        logger.debug("New packet id={} with duration time={} generated by Node id={} at time={}.".format(frame.number,
-                                                                                                         frame.duration,
-                                                                                                         frame.owner,
+        return self.num_frames
+
+    # Adds a new packet to the simulation frame table, split for frequency hopping in FHSS, and returns the frame ids
+    def create_frame(self, current_time, duration, frame_table):
+        number = self.get_num_frames()
+
+        if self.modulation == 'FHSS':
+            # Frame split for frequency hopping
+            channels, start_times, end_times, is_header, self.position_hop_list = Packet.divide_frame(
+                current_time,
+                duration,
+                self.hop_list,
+                self.position_hop_list,
+                self.hop_duration,
+                self.tx_header_duration_ms,
+                self.num_rep_header)
+            frame_ids = frame_table.append(owner=self.device_id,
+                                           number=number,
+                                           channel=channels,
+                                           start_time=start_times,
+                                           end_time=end_times,
+                                           is_header=is_header,
+                                           num_header=self.num_rep_header,
+                                           part_num=np.arange(len(start_times)),
+                                           n_parts=len(start_times))
+
+        elif self.modulation == 'CSS':
+            # Broadband transmission, a single frame
+            frame_ids = frame_table.append(owner=self.device_id,
+                                           number=number,
+                                           channel=-1,
+                                           start_time=current_time,
+                                           end_time=current_time + int(duration))
+
+        self.num_frames = self.num_frames + len(frame_ids)
+        logger.debug("New packet id={} with duration time={} generated by Node id={} at time={}.".format(number,
+                                                                                                         duration,
+                                                                                                         self.device_id,
                                                                                                          current_time))
-        return frame
+        return frame_ids
 
     # Returns the device id
     def get_id(self):
@@ -125,51 +167,45 @@ class Device:
     def get_next_time(self):
         return self.next_time
 
+    # Generates the time of the next transmission after current_time
+    def get_time_after(self, current_time):
+        if self.time_stream is not None:
+            return self.time_stream.next_time(current_time)
+
+        return TimeHelper.TimeHelper.next_time(current_time=current_time,
+                                               step_time=self.tx_interval,
+                                               mode=self.time_mode,
+                                               rng=self.rng,
+                                               py_rng=self.py_rng)
+
     # Initializes the node
     def init(self):
         # Generate a time to start transmitting
-        self.next_time = TimeHelper.TimeHelper.next_time(current_time=0,
-                                                         step_time=self.tx_interval,
-                                                         mode=self.time_mode)
+        self.next_time = self.get_time_after(0)
 
         logger.debug("Node id={} scheduling at time={}.".format(self.device_id, self.next_time))
 
-    # Performs the scheduled action if required
-    def time_step(self, current_time=None, maximum_time=None, sim_grid=None, device_list=None):
-        
-        # Say something when running
-        if self.device_id == 0 and current_time % 60000 == 0:
-            print(f'Simulating minute {current_time/1000/60} ...')
+    # Transmits a packet at current_time, returns the ids of its frames
+    def send_frame(self, current_time, sim_frames):
+        return self.create_frame(current_time, self.tx_header_duration_ms + self.tx_payload_duration_ms, sim_frames)
+
+    # Performs the scheduled action if required, returns the ids of the frames transmitted
+    def time_step(self, current_time=None, maximum_time=None, sim_frames=None):
+        frame_ids = range(0)
 
         # Check that the current time is the scheduled time of the device
         if current_time == self.next_time:
             logger.debug("Node id={} executing at time={}.".format(self.device_id, self.next_time))
 
             # Create the list of frames to be transmitted
-            frame = self.create_frame(current_time, self.tx_header_duration_ms + self.tx_payload_duration_ms)
-
-            if self.modulation == 'FHSS':
-                # Frame split for frequency hopping
-                frames, self.position_hop_list = frame.divide_frame(self.hop_list,
-                                                                    self.position_hop_list,
-                                                                    self.hop_duration,
-                                                                    self.tx_header_duration_ms,
-                                                                    self.num_rep_header)
-                self.pkt_list.pop()
-                self.pkt_list.extend(frames)
-
-            elif self.modulation == 'CSS':
-                frames = [frame]
-
-            # Transmit the list of frames
-            Transmission.transmit(frames, sim_grid, device_list)
+            frame_ids = self.send_frame(current_time, sim_frames)
 
             # Generate a time for the next transmission when transmission ends
-            next_time = TimeHelper.TimeHelper.next_time(current_time=current_time + self.tx_frame_duration_ms,
-                                                        step_time=self.tx_interval,
-                                                        mode=self.time_mode)
-                                                        
+            next_time = self.get_time_after(current_time + self.tx_frame_duration_ms)
+
             # If there is time for another action within simulation time, schedule it
             if next_time + self.tx_frame_duration_ms < maximum_time:
                 self.next_time = next_time
                 logger.debug("Node id={} scheduling at time={}.".format(self.device_id, self.next_time))
+
+        return frame_ids
@@ -0,0 +1,112 @@
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+
+
+class IntervalIndex:
+    """
+    Frames placed in one track (a channel or the whole band) as [start, end) intervals sorted by start time. The
+    frames overlapping an interval are found in O(log n + k), as no frame lasts more than the longest one seen.
+    Frames that ended before the current time are dropped, so the index only holds the frames in flight.
+    """
+
+    def __init__(self):
+        self.first = 0              # position of the first frame kept, the ones before it were dropped
+        self.max_duration = 0
+        self.start_time = []
+        self.end_time = []
+        self.frame_ids = []
+
+    def __len__(self):
+        return len(self.start_time) - self.first
+
+    def add(self, frame_id, start, end):
+        """Place the frame with the given id over [start, end)."""
+        position = bisect_right(self.start_time, start, lo=self.first)
+        self.start_time.insert(position, start)
+        self.end_time.insert(position, end)
+        self.frame_ids.insert(position, frame_id)
+        self.max_duration = max(self.max_duration, end - start)
+
+    def get_overlapping(self, start, end):
+        """Return the ids of the frames that overlap [start, end)."""
+        low = bisect_right(self.start_time, start - self.max_duration, lo=self.first)
+        high = bisect_left(self.start_time, end, lo=low)
+        return [self.frame_ids[k] for k in range(low, high) if self.end_time[k] > start]
+
+    def discard(self, current_time):
+        """Drop the frames that ended by current_time, no frame placed or looked up from now on can overlap them."""
+        self.first = bisect_right(self.start_time, current_time - self.max_duration, lo=self.first)
+
+        # Free the dropped positions once they are half of the lists, so that the cost is amortized
+        if 2 * self.first > len(self.start_time):
+            del self.start_time[:self.first]
+            del self.end_time[:self.first]
+            del self.frame_ids[:self.first]
+            self.first = 0
+
+
+class ChannelIndex:
+    """
+    Online replacement for the dense [freq, time] simulation grid. Each channel has an IntervalIndex of its FHSS
+    frames, created when the first frame is placed in it, and CSS frames have their own wideband index. A FHSS
+    frame overlaps the frames of its channel and the CSS frames, a CSS frame overlaps the other CSS frames and every
+    FHSS frame, which are also kept together in a narrowband index. Memory depends on the frames in flight only.
+    As in the dense grid, frames are cut at the time limit, the parts past the end of the simulation do not collide.
+    """
+
+    def __init__(self, limit=None):
+        self.time = 0
+        self.limit = limit          # end of the simulation, unlimited if None
+        self.channels = {}
+        self.wideband = IntervalIndex()
+        self.narrowband = IntervalIndex()
+
+    def advance(self, current_time):
+        """Move to current_time, new frames can not start before it."""
+        self.time = current_time
+
+    def __tracks(self, channel):
+        """Return the indexes overlapped by a frame in a channel (-1: CSS frame), dropping their ended frames."""
+        if channel == -1:
+            tracks = (self.wideband, self.narrowband)
+        else:
+            if channel not in self.channels:
+                self.channels[channel] = IntervalIndex()
+            tracks = (self.channels[channel], self.wideband)
+
+        for track in tracks:
+            track.discard(self.time)
+        return tracks
+
+    def __clip(self, start, end):
+        """Return [start, end) cut at the time limit."""
+        if self.limit is None:
+            return start, end
+        return min(start, self.limit), min(end, self.limit)
+
+    def get_overlapping(self, channel, start, end):
+        """Return the ids of the frames overlapped by a frame in a channel over [start, end)."""
+        start, end = self.__clip(start, end)
+        if start >= end:
+            return np.zeros(0, dtype=np.int64)
+
+        frame_ids = []
+        for track in self.__tracks(channel):
+            frame_ids.extend(track.get_overlapping(start, end))
+        return np.array(frame_ids, dtype=np.int64)
+
+    def add(self, frame_id, channel, start, end):
+        """Place a frame in a channel over [start, end)."""
+        start, end = self.__clip(start, end)
+        if start >= end:
+            return
+
+        if channel == -1:
+            self.wideband.add(frame_id, start, end)
+        else:
+            self.channels.setdefault(channel, IntervalIndex()).add(frame_id, start, end)
+
+            # Only looked up by CSS frames, so it also has to drop its ended frames here
+            self.narrowband.discard(self.time)
+            self.narrowband.add(frame_id, start, end)
@@ -1,11 +1,13 @@
+import functools
 import math
 
 
 class LoraHelper:
 
     # Returns a tuple with the following parameters: device_modulation, simulation_channels, device_tx_rate,
-    # number_repetitions_header, numerator_coding_rate, hop_duration
+    # number_repetitions_header, numerator_coding_rate, hop_duration. Cached, as every device looks it up
     @staticmethod
+    @functools.lru_cache(maxsize=None)
     def get_configuration(dr_mode=None):
         assert dr_mode is not None
 
@@ -26,8 +28,10 @@ class LoraHelper:
             return "CSS", 1, 0, 1, 0, None
 
     @staticmethod
+    @functools.lru_cache(maxsize=None)
     def get_time_on_air(modulation, dr_bps, pl_bytes, dr):
         """
+        Cached, as every device looks it up.
 
         :param modulation:
         :param dr_bps:
@@ -3,42 +3,22 @@ import logging
 logger = logging.getLogger(__name__)
 
 class Map:
-    # Singleton, only one instance
-    __instance = None
-
     size_x = 0
     size_y = 0
     position_mode = None
 
-    # The Map class contains the device list
-    device_list = []
-
-    @staticmethod
-    def get_instance():
-        if (Map.__instance == None):
-            logger.fatal("Map class has not been instantiated!")
-            raise Exception("Map class has not been instantiated!")
-        
-        # Return instance 
-        return Map.__instance 
-
     # Class initializer
     # size_x: Maximum x size (millimiters, default = 10 meters)
     # size_y: Maximum y size (millimiters, default = 10 meters)
     def __init__(self, size_x=10000, size_y=10000, position_mode="uniform"):
-        # Check instance exists
-        if (Map.__instance != None):
-            logger.fatal("Map class has already been instantiated!")
-            raise Exception("Map class has already been instantiated!")
-        
-        # Assign instance
-        Map.__instance = self
-
-        # Assign other parameters
+        # Assign parameters
         self.size_x = size_x
         self.size_y = size_y
         self.position_mode = position_mode
 
+        # The Map contains the device list
+        self.device_list = []
+
         logger.info("Created simulation map with size x={}, y={} with mode={}.".format(self.size_x, self.size_y, self.position_mode))
 
     # Returns the map size
@@ -1,12 +1,15 @@
 import logging
 
+import numpy as np
+
 logger = logging.getLogger(__name__)
 
 
 class Frame:
 
     def __init__(self, owner=None, number=None, duration=None, modulation=None, start_time=None,
-                 hop_duration=0, channel=-1, is_header=0, num_header=1, part_num=0, n_parts=1):
+                 hop_duration=0, channel=-1, is_header=0, num_header=1, part_num=0, n_parts=1, frame_id=None):
+        self.frame_id = frame_id        # simulation-wide id of the frame in the simulation frame table
         self.owner = int(owner)
         self.number = number
         self.duration = int(duration)   # must fit simulation array resolution
@@ -24,87 +27,160 @@ class Frame:
         self.end_time = start_time + self.duration
         self.collided = 0
 
-    def divide_frame(self, hop_list, position_hop_list, hop_duration, header_duration, num_rep_header):
+
+class FrameTable:
+    """
+    Frames transmitted in a simulation, shared by all devices and stored column-wise with one typed array per
+    frame attribute. Frame ids are consecutive, the frame with id first_id being the first row of the table, so the
+    oldest frames can be discarded once they are no longer needed. Frame objects are only built on demand.
+    """
+
+    # Name and type of each column
+    columns = (('owner', np.int32),
+               ('number', np.int32),
+               ('part_num', np.int16),
+               ('n_parts', np.int16),
+               ('num_header', np.int8),
+               ('channel', np.int16),         # -1: CSS frame using all bandwidth
+               ('start_time', np.int64),
+               ('end_time', np.int64),
+               ('is_header', np.int8),
+               ('collided', np.int8))
+
+    def __init__(self, capacity=1024):
+        self.first_id = 0
+        self.size = 0
+        self.capacity = capacity
+        for name, dtype in self.columns:
+            setattr(self, name, np.zeros(self.capacity, dtype=dtype))
+
+    def __len__(self):
+        return self.size
+
+    def reserve(self, n_frames):
+        """Make room for n_frames more rows, doubling the capacity so that growth is amortized."""
+        if self.size + n_frames > self.capacity:
+            self.capacity = max(2 * self.capacity, self.size + n_frames)
+            for name, dtype in self.columns:
+                column = np.zeros(self.capacity, dtype=dtype)
+                column[:self.size] = getattr(self, name)[:self.size]
+                setattr(self, name, column)
+
+    def append(self, owner, number, channel, start_time, end_time, is_header=0, num_header=1, part_num=0, n_parts=1):
         """
-        Create temp frames based on this frame.
-
-        :param num_rep_header:
-        :param header_duration:
-        :param hop_duration:
-        :param hop_list:
-        :param position_hop_list:
-        :return: the list of temp frames, the next position in hop list
+        Add the parts of a frame, one row per part. Scalars are shared by all parts, arrays give one value per part.
+
+        :return: range with the ids of the new frames
         """
-        # Initial values
-        frames = []
-        part_num = self.part_num
-        start_time = self.start_time
-        self.num_header = num_rep_header
-        header_duration = int(header_duration)
-        hop_duration = int(hop_duration)
-
-        # Get number of partitions
-        pl_duration = self.duration - header_duration
-        n_pl_parts = int(pl_duration // float(hop_duration))    # n parts of duration hop_duration
-        last_part_duration = pl_duration % hop_duration         # rest duration
-        assert n_pl_parts * hop_duration + last_part_duration + header_duration == self.duration
-
-        # Get total number of parts
-        if last_part_duration:
-            total_num_parts = n_pl_parts + 1 + self.num_header
-        else:
-            total_num_parts = n_pl_parts + self.num_header
-
-        # Create header(s)
-        for header in range(self.num_header):
-            frame = Frame(owner=self.owner,
-                          number=self.number,
-                          duration=header_duration,
-                          modulation=self.modulation,
-                          hop_duration=header_duration,     # header is fully txed in same channel
-                          start_time=start_time,
-                          channel=hop_list[position_hop_list],
-                          is_header=1,
-                          num_header=self.num_header,
-                          part_num=part_num,
-                          n_parts=total_num_parts)
-            frames.append(frame)
-            start_time = start_time + header_duration
-            position_hop_list = position_hop_list + 1
-            part_num = part_num + 1
-
-        # Create payload parts
-        for part in range(n_pl_parts):
-            frame = Frame(owner=self.owner,
-                          number=self.number,
-                          duration=hop_duration,
-                          modulation=self.modulation,
-                          hop_duration=hop_duration,
-                          start_time=start_time,
-                          channel=hop_list[position_hop_list],
-                          is_header=0,
-                          num_header=self.num_header,
-                          part_num=part_num,
-                          n_parts=total_num_parts)
-            frames.append(frame)
-            start_time = start_time + hop_duration
-            position_hop_list = position_hop_list + 1
-            part_num = part_num + 1
-
-        # Create remaining payload part if exists
-        if last_part_duration:
-            frame = Frame(owner=self.owner,
-                          number=self.number,
-                          duration=last_part_duration,
-                          modulation=self.modulation,
-                          hop_duration=hop_duration,
-                          start_time=start_time + last_part_duration,
-                          channel=hop_list[position_hop_list],
-                          is_header=0,
-                          num_header=self.num_header,
-                          part_num=part_num,
-                          n_parts=total_num_parts)
-            frames.append(frame)
-            position_hop_list = position_hop_list + 1
-
-        return frames, position_hop_list
+        n_frames = len(np.atleast_1d(start_time))
+        self.reserve(n_frames)
+
+        rows = slice(self.size, self.size + n_frames)
+        self.owner[rows] = owner
+        self.number[rows] = number
+        self.part_num[rows] = part_num
+        self.n_parts[rows] = n_parts
+        self.num_header[rows] = num_header
+        self.channel[rows] = channel
+        self.start_time[rows] = start_time
+        self.end_time[rows] = end_time
+        self.is_header[rows] = is_header
+        self.collided[rows] = 0
+
+        frame_ids = range(self.first_id + self.size, self.first_id + self.size + n_frames)
+        self.size = self.size + n_frames
+        return frame_ids
+
+    def discard(self, n_frames):
+        """Drop the first n_frames rows, the ids of the remaining frames do not change."""
+        remaining = self.size - n_frames
+        for name, _ in self.columns:
+            column = getattr(self, name)
+            column[:remaining] = column[n_frames:self.size]
+        self.first_id = self.first_id + n_frames
+        self.size = remaining
+
+    def get_row(self, frame_id):
+        """Return the row of a frame id."""
+        row = frame_id - self.first_id
+        assert 0 <= row < self.size
+        return row
+
+    def get_column(self, name):
+        """Return a view of the used rows of a column."""
+        return getattr(self, name)[:self.size]
+
+    def get_frame(self, frame_id):
+        """Build the Frame object of a frame id, for debugging."""
+        row = self.get_row(frame_id)
+        channel = int(self.channel[row])
+        frame = Frame(owner=self.owner[row],
+                      number=int(self.number[row]),
+                      duration=self.end_time[row] - self.start_time[row],
+                      modulation='CSS' if channel == -1 else 'FHSS',
+                      start_time=self.start_time[row],
+                      channel=channel,
+                      is_header=int(self.is_header[row]),
+                      num_header=int(self.num_header[row]),
+                      part_num=int(self.part_num[row]),
+                      n_parts=int(self.n_parts[row]),
+                      frame_id=frame_id)
+        frame.collided = int(self.collided[row])
+        return frame
+
+    def get_frames(self, owner=None):
+        """Build the Frame objects of all rows, or only the ones of a device, for debugging."""
+        rows = np.arange(self.size) if owner is None else np.flatnonzero(self.get_column('owner') == owner)
+        return [self.get_frame(self.first_id + row) for row in rows]
+
+    def to_array(self):
+        """Return a copy of the used rows as a structured array, e.g. to save them to a file."""
+        array = np.empty(self.size, dtype=list(self.columns))
+        for name, _ in self.columns:
+            array[name] = self.get_column(name)
+        return array
+
+
+def divide_frame(start_time, duration, hop_list, position_hop_list, hop_duration, header_duration, num_rep_header):
+    """
+    Split a frame into its header repetitions and payload parts, each one transmitted on the next channel of the
+    hop list.
+
+    :param start_time: start time of the frame
+    :param duration: duration of one header and the payload
+    :param hop_list:
+    :param position_hop_list:
+    :param hop_duration:
+    :param header_duration:
+    :param num_rep_header:
+    :return: channel, start time, end time and header flag of each part, the next position in hop list
+    """
+    header_duration = int(header_duration)
+    hop_duration = int(hop_duration)
+
+    # Get number of partitions
+    pl_duration = int(duration) - header_duration
+    n_pl_parts = int(pl_duration // float(hop_duration))    # n parts of duration hop_duration
+    last_part_duration = pl_duration % hop_duration         # rest duration
+    assert n_pl_parts * hop_duration + last_part_duration + header_duration == duration
+
+    # Header(s), payload parts and remaining payload part if exists
+    durations = [header_duration] * num_rep_header + [hop_duration] * n_pl_parts
+    if last_part_duration:
+        durations.append(last_part_duration)
+    durations = np.array(durations, dtype=np.int64)
+    total_num_parts = len(durations)
+
+    # Parts are transmitted one after the other
+    start_times = int(start_time) + np.concatenate(([0], np.cumsum(durations[:-1])))
+    if last_part_duration:
+        start_times[-1] = start_times[-1] + last_part_duration
+    end_times = start_times + durations
+
+    is_header = np.zeros(total_num_parts, dtype=np.int8)
+    is_header[:num_rep_header] = 1
+
+    channels = hop_list[position_hop_list:position_hop_list + total_num_parts]
+    assert len(channels) == total_num_parts
+
+    return channels, start_times, end_times, is_header, position_hop_list + total_num_parts
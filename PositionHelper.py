@@ -1,24 +1,19 @@
 import numpy as np
 
-import Map
-
 class PositionHelper:
 
-    # Allows to generate a position with normal or uniform distributions
+    # Allows to generate a position with normal or uniform distributions within a map, drawn from the rng given
     @staticmethod
-    def get_position():
-        # Get Map instance
-        map = Map.Map.get_instance()
-
+    def get_position(sim_map=None, rng=np.random):
         # Get Map size and mode
-        x_max, y_max = map.get_size()
-        mode         = map.get_mode()
+        x_max, y_max = sim_map.get_size()
+        mode         = sim_map.get_mode()
 
         # Get the distribution
         if (mode == "normal"):
-            x, y = PositionHelper.__normal_distribution()
+            x, y = PositionHelper.__normal_distribution(rng)
         elif (mode == "uniform"):
-            x, y = PositionHelper.__uniform_distribution()
+            x, y = PositionHelper.__uniform_distribution(rng)
         else:
             raise("Error!")       
         
@@ -47,16 +42,16 @@ class PositionHelper:
     
     # Creates a position uniform distribution
     @staticmethod
-    def __uniform_distribution():
-        x = np.random.uniform(low=0, high=1)
-        y = np.random.uniform(low=0, high=1)
+    def __uniform_distribution(rng):
+        x = rng.uniform(low=0, high=1)
+        y = rng.uniform(low=0, high=1)
         return (x, y)
 
     # Creates a position normal distribution
     @staticmethod
-    def __normal_distribution(): 
+    def __normal_distribution(rng): 
         mean = 0.5
         stddev = 0.5/3
-        x = np.random.normal(loc=mean, scale=stddev)
-        y = np.random.normal(loc=mean, scale=stddev)
+        x = rng.normal(loc=mean, scale=stddev)
+        y = rng.normal(loc=mean, scale=stddev)
         return (x, y)
\ No newline at end of file
@@ -1,163 +1,194 @@
 import logging
+import glob
+import os
+import re
+import sqlite3
 
-import matplotlib.patches as patches
-import matplotlib.pyplot as plt
 import numpy as np
-from matplotlib import colors
+from numpy.lib import recfunctions
 
 mpl_logger = logging.getLogger('matplotlib')
 mpl_logger.setLevel(logging.WARNING)
 
+# Database with a record of each simulation, written by parallel simulations and read at once by the plots
+store_file = './results/results.db'
+
+# Columns of a record: name, SQL type and numpy type. The options of the simulation, its settings (see
+# Simulator.get_config), the cache key and code version (see SimulatorHelper.get_cache_key) and the metrics.
+# Missing values are read as 0 for integers (interval at maximum rate, seed of random simulations), empty for texts and
+# nan for reals.
+store_columns = (
+    ('devices',              'INTEGER', 'i8'),
+    ('interval',             'INTEGER', 'i8'),
+    ('run',                  'INTEGER', 'i8'),
+    ('t_mode',               'TEXT',    'U16'),
+    ('payload',              'INTEGER', 'i8'),
+    ('percentage',           'REAL',    'f8'),
+    ('data_rate_lora',       'INTEGER', 'i8'),
+    ('data_rate_lora_e',     'INTEGER', 'i8'),
+    ('seed',                 'INTEGER', 'i8'),
+    ('map_size_x',           'INTEGER', 'i8'),
+    ('map_size_y',           'INTEGER', 'i8'),
+    ('device_position_mode', 'TEXT',    'U16'),
+    ('simulation_duration',  'INTEGER', 'i8'),
+    ('simulation_step',      'INTEGER', 'i8'),
+    ('collision_mode',       'TEXT',    'U16'),
+    ('streaming_metrics',    'INTEGER', 'i8'),
+    ('batched_traffic',      'INTEGER', 'i8'),
+    ('sequence_type',        'TEXT',    'U16'),
+    ('code',                 'TEXT',    'U64'),
+    ('key',                  'TEXT',    'U64'),
+    ('rxed_lora',            'REAL',    'f8'),
+    ('gen_lora',             'REAL',    'f8'),
+    ('rxed_lora_e',          'REAL',    'f8'),
+    ('gen_lora_e',           'REAL',    'f8'),
+)
+metric_columns = ('rxed_lora', 'gen_lora', 'rxed_lora_e', 'gen_lora_e')
+
 
 def save_simulation(simulation, save_sim, plot_grid):
     """
     Save the grid and devices of simulation for debugging or later grid plots.
     """
     if save_sim:
-        np.save('scripts/plots/grid.npy', simulation.simulation_array.copy())
-        np.save('scripts/plots/devices.npy', simulation.simulation_map.get_devices())
+        if isinstance(simulation.simulation_array, np.ndarray):
+            np.save('scripts/plots/grid.npy', simulation.simulation_array.copy())
+        np.save('scripts/plots/frames.npy', simulation.simulation_frames.to_array())
     
     if plot_grid:
+        # Only imported when plotting, importing pyplot takes longer than a short simulation
+        import matplotlib.patches as patches
+        import matplotlib.pyplot as plt
+
         # Plot each packet using matplotlib rectangle  
-        grid = simulation.simulation_array.copy()
+        n_channels = simulation.simulation_channels
+        n_elements = simulation.simulation_elements
         devices = simulation.simulation_map.get_devices()
+        pkts = simulation.simulation_frames.to_array()
         
         fig, ax = plt.subplots(1)
 
-        for device in devices:
-            pkts = device.pkt_list
-            for pkt in pkts:
-                start = pkt.start_time
-                end = pkt.end_time
-                freq = pkt.channel
-                width = end - start
-
-                if freq == -1:
-                    height = grid.shape[0]
-                    freq = 0
-                else:
-                    height = 1
-
-                if pkt.collided:
-                    color = 'red'
-                else:
-                    color = 'royalblue'
-                    
-                rect = patches.Rectangle(
-                    (start, freq),
-                    width,
-                    height,
-                    linewidth=1,
-                    linestyle="-",
-                    edgecolor=color,
-                    facecolor=color,
-                    fill=True,
-                    alpha=0.5,
-                    antialiased=False,
-                )
-
-                ax.add_patch(rect)
+        for pkt in pkts:
+            start = pkt['start_time']
+            end = pkt['end_time']
+            freq = pkt['channel']
+            width = end - start
+
+            if freq == -1:
+                height = n_channels
+                freq = 0
+            else:
+                height = 1
+
+            if pkt['collided']:
+                color = 'red'
+            else:
+                color = 'royalblue'
+                
+            rect = patches.Rectangle(
+                (start, freq),
+                width,
+                height,
+                linewidth=1,
+                linestyle="-",
+                edgecolor=color,
+                facecolor=color,
+                fill=True,
+                alpha=0.5,
+                antialiased=False,
+            )
+
+            ax.add_patch(rect)
         ax.set_title(f'Devices: {len(devices)}')
         ax.set_xlabel('Time (sec)', fontsize=12)
         ax.set_ylabel('Frequency (488 Hz channels)', fontsize=12)
-        ax.set_xlim(0, grid.shape[1])
-        ax.set_ylim(0, grid.shape[0])
+        ax.set_xlim(0, n_elements)
+        ax.set_ylim(0, n_channels)
         fig.savefig('./images/simulated_grid.png', format='png', dpi=200)
 
+def get_packet_outcomes(frame_table, cr, rows=slice(None)):
+    """
+    De-hop the frames in the given rows of the frame table back into packets and decide which ones were lost.
+    The parts of a packet are consecutive rows starting at part 0, so each packet is evaluated with numpy
+    reductions over its run of rows: a LoRa-E packet needs at least one header not collided and a ratio of
+    non-collided payload time of at least the coding rate, a LoRa packet must not collide.
+
+    :param frame_table: table of frames in Simulation
+    :param cr: coding rate of each device, indexed by device id
+    :param rows: slice of whole packets in the frame table
+    :return: owner of each packet, True for each packet that was lost
+    """
+    part_num = frame_table.get_column('part_num')[rows]
+    first_parts = np.flatnonzero(part_num == 0)
+    if not len(first_parts):
+        return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=bool)
+
+    # Sanity check: every packet has all of its parts
+    n_parts = frame_table.get_column('n_parts')[rows]
+    assert np.array_equal(np.diff(np.append(first_parts, len(part_num))), n_parts[first_parts])
+
+    owner = frame_table.get_column('owner')[rows][first_parts]
+    is_css = frame_table.get_column('channel')[rows][first_parts] == -1
+    is_header = frame_table.get_column('is_header')[rows].astype(bool)
+    collided = frame_table.get_column('collided')[rows].astype(bool)
+    duration = frame_table.get_column('end_time')[rows] - frame_table.get_column('start_time')[rows]
+
+    # At least one header not collided
+    header_decoded = np.add.reduceat((is_header & ~collided).astype(np.int64), first_parts) > 0
+
+    # Ratio of payload time not collided, equivalent to bit
+    non_collided_pls_time = np.add.reduceat(np.where(~is_header & ~collided, duration, 0), first_parts)
+    collided_pls_time = np.add.reduceat(np.where(~is_header & collided, duration, 0), first_parts)
+    calculated_ratio = non_collided_pls_time / (non_collided_pls_time + collided_pls_time)
+
+    lost = np.where(is_css, collided[first_parts], ~header_decoded | (calculated_ratio < cr[owner]))
+    return owner, lost
+
+
+def count_packets(frame_table, devices, rows=slice(None)):
+    """
+    Returns the number of packets generated and lost by each device, for the packets in the given rows of the frame
+    table
+    """
+    device_ids = np.array([device.get_id() for device in devices], dtype=np.int64)
+    if not len(device_ids):
+        return np.zeros(0), np.zeros(0)
+
+    # Device lookups by id
+    cr = np.zeros(device_ids.max() + 1)
+    cr[device_ids] = [device.cr for device in devices]
+    position = np.zeros(device_ids.max() + 1, dtype=np.int64)
+    position[device_ids] = np.arange(len(devices))
+
+    owner, lost = get_packet_outcomes(frame_table, cr, rows)
+    generated_count = np.bincount(position[owner], minlength=len(devices))
+    lost_count = np.bincount(position[owner], weights=lost, minlength=len(devices))
+    return generated_count, lost_count
+
+
 def get_metrics(simulation):
     """ 
     Returns tuple of size 4 with received and generated packets for LoRa and LoRa-E devices
     """
     devices = simulation.simulation_map.get_devices()
+    is_lora_e = np.array([device.modulation == 'FHSS' for device in devices], dtype=bool)
+
+    # Count generated and collided packets for each device in simulation, adding the ones already retired
+    num_pkt_sent, num_pkt_coll = count_packets(simulation.simulation_frames, devices)
+    if simulation.retired_sent is not None:
+        num_pkt_sent = num_pkt_sent + simulation.retired_sent
+        num_pkt_coll = num_pkt_coll + simulation.retired_coll
 
     # LoRa lists
-    lora_num_pkt_sent_list = []
-    lora_num_pkt_coll_list = []
+    lora_num_pkt_sent_list = num_pkt_sent[~is_lora_e]
+    lora_num_pkt_coll_list = num_pkt_coll[~is_lora_e]
 
     # LoRa-E lists
-    lora_e_num_pkt_sent_list = []
-    lora_e_num_pkt_coll_list = []
-
-    # Count collisions for each device in simulation
-    for device in devices:
-        
-        if device.modulation == 'FHSS':
-
-            frame_count = device.get_num_frames()
-            de_hopped_frames_count = 0
-            collisions_count = 0
-
-            # Iterate over frames, de-hop, count whole frame as collision if (1-CR) * num_pls payloads collided
-            frame_index = 0
-            while frame_index < frame_count:
-                this_frame = device.pkt_list[frame_index]
-                if frame_index == 0:
-                    assert this_frame.is_header     # sanity check: first frame in list must be a header
-
-                # De-hop the frame to its original form
-                total_num_parts = this_frame.n_parts
-                header_repetitions = this_frame.num_header
-                headers_to_evaluate = device.pkt_list[frame_index:frame_index + header_repetitions]
-                pls_to_evaluate = device.pkt_list[frame_index + header_repetitions:frame_index + total_num_parts]
-
-                # At least I need one header not collided
-                header_decoded = False
-                for header in headers_to_evaluate:
-                    assert header.is_header         # sanity check
-                    if not header.collided:
-                        header_decoded = True
-                        break
-
-                if header_decoded:
-                    # Check how many pls collided
-                    collided_pls_time_count = 0
-                    non_collided_pls_time_count = 0
-                    for pl in pls_to_evaluate:
-                        assert not pl.is_header     # sanity check
-                        if pl.collided:
-                            collided_pls_time_count = collided_pls_time_count + pl.duration
-                        else:
-                            non_collided_pls_time_count = non_collided_pls_time_count + pl.duration
-
-                    # Check for time ratio, equivalent to bit
-                    calculated_ratio = float(non_collided_pls_time_count) / (non_collided_pls_time_count + collided_pls_time_count)
-                    if calculated_ratio < device.cr:
-                        de_hopped_frame_collided = True
-                    else:
-                        de_hopped_frame_collided = False
-                else:
-                    de_hopped_frame_collided = True
-
-                # Prepare next iter
-                frame_index = frame_index + total_num_parts
-                de_hopped_frames_count = de_hopped_frames_count + 1
-
-                # Increase collision count if frame can not be decoded
-                if de_hopped_frame_collided:
-                    collisions_count = collisions_count + 1
-
-            # Store device results
-            lora_e_num_pkt_sent_list.append(de_hopped_frames_count)
-            lora_e_num_pkt_coll_list.append(collisions_count)
-
-            # Sanity check: de-hopped frames should be equal to the number of unique frame ids
-            pkt_nums = [pkt.number for pkt in device.pkt_list]
-            assert len(set(pkt_nums)) == de_hopped_frames_count
-
-        elif device.modulation == 'CSS':
-            # Straight-forward collision count
-            # how many packets were sent by the device
-            lora_num_pkt_sent_list.append(device.get_num_frames())
-
-            # how many of them collided
-            count = 0
-            for pkt in device.pkt_list:
-                if pkt.collided:
-                    count += 1
-            lora_num_pkt_coll_list.append(count)
+    lora_e_num_pkt_sent_list = num_pkt_sent[is_lora_e]
+    lora_e_num_pkt_coll_list = num_pkt_coll[is_lora_e]
 
     # Calculate LoRa metrics
-    if lora_num_pkt_sent_list:
+    if len(lora_num_pkt_sent_list):
         n_coll_per_dev = np.nanmean(lora_num_pkt_coll_list)
         n_gen_per_dev = np.nanmean(lora_num_pkt_sent_list)
         n_rxed_per_dev = n_gen_per_dev - n_coll_per_dev
@@ -166,7 +197,7 @@ def get_metrics(simulation):
         n_rxed_per_dev = None
 
     # Calculate LoRa-E metrics
-    if lora_e_num_pkt_sent_list:
+    if len(lora_e_num_pkt_sent_list):
         n_coll_per_dev_lora_e = np.nanmean(lora_e_num_pkt_coll_list)
         n_gen_per_dev_lora_e = np.nanmean(lora_e_num_pkt_sent_list)
         n_rxed_per_dev_lora_e = n_gen_per_dev_lora_e - n_coll_per_dev_lora_e
@@ -178,4 +209,190 @@ def get_metrics(simulation):
 
     metrics = (n_rxed_per_dev, n_gen_per_dev, n_rxed_per_dev_lora_e, n_gen_per_dev_lora_e)
 
-    return metrics
\ No newline at end of file
+    return metrics
+
+
+def connect_store(file_name=store_file):
+    """
+    Open the result store, creating it if needed. Records are looked up by key, and the store is in write-ahead
+    log mode so that parallel simulations append to it while others read, waiting for each other's writes.
+    """
+    if os.path.dirname(file_name):
+        os.makedirs(os.path.dirname(file_name), exist_ok=True)
+
+    connection = sqlite3.connect(file_name, timeout=600)
+    connection.execute('PRAGMA journal_mode=WAL')
+    columns = ', '.join(f'"{name}" {sql_type}' for name, sql_type, _ in store_columns)
+    connection.execute(f'CREATE TABLE IF NOT EXISTS results ({columns}, PRIMARY KEY ("key"))')
+
+    # Stores created before a column was added get it empty, read as its default
+    existing = [row[1] for row in connection.execute('PRAGMA table_info(results)')]
+    for name, sql_type, _ in store_columns:
+        if name not in existing:
+            connection.execute(f'ALTER TABLE results ADD COLUMN "{name}" {sql_type}')
+    return connection
+
+def store_metrics(values, metrics, file_name=store_file):
+    """
+    Record the metrics of a simulation in the result store, replacing an earlier record with the same key.
+
+    :param values: dict with the options, settings, code and key of the simulation, by column name
+    :param metrics: tuple of metrics from get_metrics
+    :param file_name: result store file
+    """
+    record = dict(values, **dict(zip(metric_columns, metrics)))
+    if record['interval'] == 'max':
+        record['interval'] = None
+
+    # Numpy scalars of the metrics as Python numbers, which sqlite stores
+    names = [name for name, _, _ in store_columns]
+    row = [record[name].item() if isinstance(record[name], np.generic) else record[name] for name in names]
+    columns = ', '.join(f'"{name}"' for name in names)
+
+    connection = connect_store(file_name)
+    try:
+        with connection:
+            connection.execute(f'INSERT OR REPLACE INTO results ({columns}) VALUES ({", ".join("?" * len(names))})', row)
+    finally:
+        connection.close()
+
+def load_metrics(key, file_name=store_file):
+    """Return the metrics recorded with the given key in the result store, None if there are none"""
+    if not os.path.isfile(file_name):
+        return None
+
+    connection = connect_store(file_name)
+    try:
+        row = connection.execute(f'SELECT {", ".join(metric_columns)} FROM results WHERE "key" = ?', (key,)).fetchone()
+    finally:
+        connection.close()
+    return row
+
+def import_npy_files(results_dir='./results/', file_name=store_file):
+    """
+    Record in the result store the metrics of the .npy files that simulations saved before it, named
+    results_dir/dr<data rate>/pl<payload>/<devices>_<interval>_<run>.npy or p<percentage>/pl... for mixed networks.
+    Their name is all that is known of them: the other options, the settings and the code are left empty (read as 0,
+    or nan for reals), the code is 'npy' and the key is the path of the file, so importing again replaces them.
+
+    :param results_dir: directory with the results directories of the files
+    :param file_name: result store file
+    :return: number of files imported and list of the files skipped, with names or metrics not of this form
+    """
+    pattern = re.compile(r'(?:dr(\d+)|p([0-9.]+))/pl(\d+)/(\d+)_(max|\d+)_(\d+)\.npy$')
+
+    imported = 0
+    skipped = []
+    for path in sorted(glob.glob(os.path.join(results_dir, '*', 'pl*', '*.npy'))):
+        match = pattern.search(path.replace(os.sep, '/'))
+        metrics = np.load(path, allow_pickle=True) if match else None
+        if metrics is None or metrics.shape != (len(metric_columns),):
+            skipped.append(path)
+            continue
+
+        data_rate, percentage, payload, devices, interval, run = match.groups()
+        values = {name: None for name, _, _ in store_columns}
+        values.update(devices=int(devices), run=int(run), payload=int(payload), code='npy',
+                      key='npy:' + os.path.relpath(path, results_dir).replace(os.sep, '/'))
+        if interval == 'max':
+            values.update(interval='max', t_mode='max')
+        else:
+            values.update(interval=int(interval))
+        if data_rate is None:
+            values.update(percentage=float(percentage))
+        elif int(data_rate) < 8:
+            # LoRa data rates are 0 to 5, LoRa-E data rates are 8 to 11
+            values.update(percentage=1., data_rate_lora=int(data_rate))
+        else:
+            values.update(percentage=0., data_rate_lora_e=int(data_rate))
+
+        store_metrics(values, tuple(metrics.tolist()), file_name)
+        imported = imported + 1
+
+    return imported, skipped
+
+def read_metrics(file_name=store_file, latest=True, **values):
+    """
+    Read the records of the result store with the given column values at once, e.g. all the runs of a figure.
+
+    :param file_name: result store file
+    :param latest: only read the latest record of each simulation if it was run with several versions of the code
+    :param values: value, or list of values, of the records to read by column name
+    :return: numpy structured array with the columns of the records, see store_columns
+    """
+    names = [name for name, _, _ in store_columns]
+    dtype = [(name, np_type) for name, _, np_type in store_columns]
+    if not os.path.isfile(file_name):
+        return np.zeros(0, dtype=dtype)
+
+    # Missing integers are read as 0, missing texts as empty and missing reals as nan
+    defaults = {'INTEGER': '0', 'TEXT': "''"}
+    columns = ', '.join(f'COALESCE("{name}", {defaults[sql_type]})' if sql_type in defaults else f'"{name}"'
+                        for name, sql_type, _ in store_columns)
+
+    conditions = []
+    parameters = []
+    for name, value in values.items():
+        if name not in names:
+            raise Exception(f"Unknown result store column {name}!")
+        value = list(value) if isinstance(value, (list, tuple, range, np.ndarray)) else [value]
+        conditions.append(f'"{name}" IN ({", ".join("?" * len(value))})')
+        parameters.extend(v.item() if isinstance(v, np.generic) else v for v in value)
+    if latest:
+        # INSERT OR REPLACE deletes the record it replaces and inserts a new row, which takes a row id higher than
+        # all the others, so the latest record of each simulation is the one with the highest row id
+        point = ', '.join(f'"{name}"' for name in names if name not in ('code', 'key') + metric_columns)
+        conditions.append(f'rowid IN (SELECT MAX(rowid) FROM results GROUP BY {point})')
+
+    query = f'SELECT {columns} FROM results'
+    if conditions:
+        query = query + ' WHERE ' + ' AND '.join(conditions)
+
+    connection = connect_store(file_name)
+    try:
+        rows = connection.execute(query, parameters).fetchall()
+    finally:
+        connection.close()
+    return np.array(rows, dtype=dtype)
+
+def mean_over_runs(records, keys, fields=metric_columns):
+    """
+    Group the records by the key columns and average the fields over the runs of each group, ignoring missing
+    (nan) values.
+
+    :param records: structured array from read_metrics
+    :param keys: columns that identify a group, e.g. ('data_rate_lora_e', 'devices')
+    :param fields: columns to average
+    :return: structured array sorted by the key columns, with them, the mean of each field and the runs of the group
+    """
+    groups, group = np.unique(recfunctions.repack_fields(records[list(keys)]), return_inverse=True)
+    group = group.ravel()
+
+    means = np.zeros(len(groups), dtype=groups.dtype.descr + [(field, 'f8') for field in fields] + [('runs', 'i8')])
+    for key in keys:
+        means[key] = groups[key]
+    means['runs'] = np.bincount(group, minlength=len(groups))
+
+    for field in fields:
+        valid = ~np.isnan(records[field])
+        total = np.bincount(group, weights=np.where(valid, records[field], 0.), minlength=len(groups))
+        count = np.bincount(group, weights=valid, minlength=len(groups))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means[field] = total / count
+    return means
+
+def get_data_rate_metrics(means, data_rate):
+    """
+    Return the groups of simulations with all their devices in the given data rate, and their received and
+    generated packets per device: the LoRa metrics for data rates 0 to 5, the LoRa-E ones for 8 to 11.
+
+    :param means: structured array from mean_over_runs, grouped by percentage, data_rate_lora and data_rate_lora_e
+    :param data_rate: data rate of the devices
+    :return: the groups, their received packets and their generated packets
+    """
+    if data_rate < 8:
+        groups = means[(means['percentage'] == 1) & (means['data_rate_lora'] == data_rate)]
+        return groups, groups['rxed_lora'], groups['gen_lora']
+    else:
+        groups = means[(means['percentage'] == 0) & (means['data_rate_lora_e'] == data_rate)]
+        return groups, groups['rxed_lora_e'], groups['gen_lora_e']
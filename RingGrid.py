@@ -0,0 +1,66 @@
+import numpy as np
+
+
+class RingGrid:
+    """
+    Time-frequency simulation grid that only keeps a window of width slots starting at the current time, indexed
+    modulo the width. It is used as the [freq, time] simulation array, with time slices in absolute simulation time.
+    Frames are written in the grid when they start to be transmitted and can not last more than the width, so the
+    slots left behind by the current time are never looked at again and are reused for the times ahead. As in the
+    dense grid, the slots from end_time on do not exist, the parts of the frames past the end of the simulation are
+    neither written nor read.
+    """
+
+    def __init__(self, n_channels, width, dtype=np.int32, end_time=None):
+        self.width = int(width)
+        self.end_time = end_time
+        self.time = 0       # first time kept in the window
+        self.array = np.zeros((n_channels, self.width), dtype=dtype)
+
+    @property
+    def shape(self):
+        return self.array.shape
+
+    def advance(self, current_time):
+        """Move the window to start at current_time, clearing the slots of the times left behind."""
+        if current_time <= self.time:
+            return
+
+        if current_time - self.time >= self.width:
+            self.array[:] = 0
+        else:
+            self.array[:, self.__columns(self.time, current_time)] = 0
+        self.time = current_time
+
+    def __columns(self, start, end):
+        """Return the columns of the absolute times [start, end), as a slice unless they wrap around."""
+        first = start % self.width
+        last = first + (end - start)
+        if last <= self.width:
+            return slice(first, last)
+        return np.r_[first:self.width, 0:last - self.width]
+
+    def __index(self, key):
+        freq, times = key
+
+        # Times before the window are gone, e.g. the parts already transmitted of a frame marked as collided
+        start = max(int(times.start), self.time)
+        end = int(times.stop)
+        if self.end_time is not None:
+            end = min(end, self.end_time)
+        assert end <= self.time + self.width, "Frame longer than the grid window."
+
+        columns = self.__columns(start, max(start, end))
+        if not isinstance(columns, slice) and isinstance(freq, (list, np.ndarray)):
+            # Select the rows and the wrapped columns as a block, not pairwise
+            freq = np.asarray(freq)[:, None]
+
+        return freq, columns
+
+    def __getitem__(self, key):
+        freq, columns = self.__index(key)
+        return self.array[freq, columns]
+
+    def __setitem__(self, key, value):
+        freq, columns = self.__index(key)
+        self.array[freq, columns] = value
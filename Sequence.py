@@ -1,3 +1,6 @@
+import json
+import os
+
 import numpy as np
 
 import SequenceHelper
@@ -5,7 +8,16 @@ import SequenceHelper
 
 class Sequence:
 
-    def __init__(self, modulation, n_devices, n_bits, n_channels, n_hops, seq_type, dr):
+    # Minimum distance between consecutive channels of EU sequences
+    min_ch_dist_eu = 8
+
+    # Sequence types whose hops are computed as devices hop, from a hash or a period, instead of pre-computed
+    lazy_seq_types = ('LFSR', 'circular', 'lora-e-eu-hash', 'lora-e-eu-cycle')
+
+    # Attributes with the arrays of sequences, the one used depends on the type
+    array_names = ('hopping_sequence', 'hop_seeds', 'hop_cycles')
+
+    def __init__(self, modulation, n_devices, n_bits, n_channels, n_hops, seq_type, dr, rng=np.random):
         """
         In FHSS, devices communicate according to various channel hopping schemes, with each subsequent transmission
         utilizing the next channel defined in a hopping sequence.
@@ -13,8 +25,9 @@ class Sequence:
         :param n_devices: number of devices in simulation
         :param n_bits: number of bits in LORA-E packet with frequency hopping information
         :param n_channels: number of channels that the device is allowed to hop to
-        :param n_hops: maximum number of hops during simulation
+        :param n_hops: maximum number of hops during simulation, only needed by the types not in lazy_seq_types
         :param seq_type: the method to generate the hopping sequence
+        :param rng: random number generator to draw the sequences from
         """
         self.n_devices = n_devices
         self.n_bits = n_bits
@@ -24,7 +37,8 @@ class Sequence:
         self.dr = dr
 
         self.cycle_length = 0       # The period of the sequence
-        self.min_ch_dist_eu = 8
+        self.hop_seeds = None       # The random number of each device in hash sequences
+        self.hop_cycles = None      # One period of each device in periodic sequences
 
         # Pre alloc
         if modulation == 'FHSS':
@@ -33,26 +47,30 @@ class Sequence:
             if seq_type == 'random':
                 # Infinite random Sequence
                 self.cycle_length = -1  # infinite sequence
-                self.hopping_sequence = SequenceHelper.SequenceHelper.random_seq(self.n_channels, self.n_devices, self.n_hops)
+                self.hopping_sequence = SequenceHelper.SequenceHelper.random_seq(self.n_channels, self.n_devices, self.n_hops, rng)
 
             elif seq_type == 'LFSR':
                 # m-sequences (Maximal Length Linear Feedback Shift Register sequences)
                 self.cycle_length = (2 ** n_bits) - 1   # -1 bc all-zero initial state of registers always returns 0
-                self.hopping_sequence = SequenceHelper.SequenceHelper.lfsr_seq(self.cycle_length, self.n_channels, self.n_devices, self.n_hops)
+                self.hop_cycles = SequenceHelper.SequenceHelper.lfsr_seq(self.cycle_length, self.n_channels, self.n_devices, self.cycle_length, rng)
+                self.hopping_sequence = None
 
             elif seq_type == 'circular':
                 # Easy orthogonal sequence implementation for time synchronized devices
                 self.cycle_length = self.n_channels
-                self.hopping_sequence = SequenceHelper.SequenceHelper.circ_seq(self.cycle_length, self.n_channels, self.n_devices, self.n_hops)
+                self.hop_cycles = SequenceHelper.SequenceHelper.circ_seq(self.cycle_length, self.n_channels, self.n_devices, self.cycle_length)
+                self.hopping_sequence = None
 
             elif seq_type == 'lora-e-eu-inf':
                 # Infinite random Sequence with EU minimum hop distance
-                self.hopping_sequence = SequenceHelper.SequenceHelper.lora_e_random_seq(self.n_channels, self.min_ch_dist_eu, self.n_devices, self.n_hops)
+                self.hopping_sequence = SequenceHelper.SequenceHelper.lora_e_random_seq(self.n_channels, self.min_ch_dist_eu, self.n_devices, self.n_hops, rng)
                 self.cycle_length = -1
 
             elif seq_type == 'lora-e-eu-hash':
-                # Cyclical random Sequence with EU minimum hop distance
-                self.hopping_sequence = SequenceHelper.SequenceHelper.lora_e_hash(self.n_channels, self.min_ch_dist_eu,  self.n_devices, self.n_hops, self.n_bits)
+                # Cyclical random Sequence with EU minimum hop distance, a function of a n_bits-bit random number of
+                # each device and the hop index, so each device computes its hops as it goes, see HashHopList
+                self.hop_seeds = SequenceHelper.SequenceHelper.random_seq(domain=2**n_bits - 1, n_devs=self.n_devices, dur=1, rng=rng)[:, 0]
+                self.hopping_sequence = None
                 self.cycle_length = -1
 
             elif seq_type == 'lora-e-eu-cycle':
@@ -63,7 +81,8 @@ class Sequence:
                     self.cycle_length = 86
                 else:
                     raise Exception('N/A')
-                self.hopping_sequence = SequenceHelper.SequenceHelper.lora_e_random_seq_limited(self.cycle_length, self.n_channels, self.min_ch_dist_eu, self.n_devices, self.n_hops)
+                self.hop_cycles = SequenceHelper.SequenceHelper.lora_e_random_seq_limited(self.cycle_length, self.n_channels, self.min_ch_dist_eu, self.n_devices, self.cycle_length, rng)
+                self.hopping_sequence = None
 
             else:
                 print('Unknown type of code sequence selected.')
@@ -71,10 +90,146 @@ class Sequence:
             # modulation is plan LoRa, no hop sequence is needed
             self.hopping_sequence = np.zeros((self.n_devices, 1), dtype=int)
 
+    def get_channels(self):
+        """Return the channels that the sequences can hop to."""
+        return SequenceHelper.SequenceHelper.get_channels(self.seq_type, self.n_channels, self.min_ch_dist_eu)
+
     def get_hopping_sequence(self, device_id):
-        """Return LIST of frequency sequence assigned to the device id."""
+        """
+        Return LIST of frequency sequence assigned to the device id, a HashHopList for hash sequences and a
+        CycleHopList for periodic ones.
+        """
+        if self.hop_seeds is not None:
+            return HashHopList(self.hop_seeds[device_id], self.n_channels, self.min_ch_dist_eu)
+        if self.hop_cycles is not None:
+            return CycleHopList(self.hop_cycles[device_id])
         return self.hopping_sequence[device_id].tolist()
 
+    def get_nbytes(self):
+        """Return the bytes taken by the sequences."""
+        if self.hop_seeds is not None:
+            return self.hop_seeds.nbytes
+        if self.hop_cycles is not None:
+            return self.hop_cycles.nbytes
+        return self.hopping_sequence.nbytes
+
+    def get_attributes(self):
+        """Return the attributes of the sequences but their array, and the name of the array."""
+        name = next(name for name in self.array_names if getattr(self, name) is not None)
+        return {key: value for key, value in vars(self).items() if key not in self.array_names}, name
+
+    @staticmethod
+    def from_attributes(attributes, name, array):
+        """Return the Sequence with the given attributes and array of sequences, see get_attributes."""
+        seqs = Sequence.__new__(Sequence)
+        vars(seqs).update(attributes)
+        for array_name in Sequence.array_names:
+            setattr(seqs, array_name, None)
+        setattr(seqs, name, array)
+        return seqs
+
+    def save(self, file_name, **extra):
+        """
+        Save the sequences to file_name.json, with the extra values given, and their array to file_name.npy. The
+        json file is written last, so a Sequence is only found once it is complete.
+        """
+        attributes, name = self.get_attributes()
+        temp_name = file_name + '.' + str(os.getpid())
+        np.save(temp_name + '.npy', getattr(self, name))
+        os.replace(temp_name + '.npy', file_name + '.npy')
+
+        with open(temp_name + '.json', 'w') as file:
+            json.dump(dict(attributes, array=name, extra=extra), file)
+        os.replace(temp_name + '.json', file_name + '.json')
+
+    @staticmethod
+    def load(file_name):
+        """
+        Load the sequences saved to file_name, with their array memory-mapped read-only.
+        :return: the Sequence and the extra values saved with it
+        """
+        with open(file_name + '.json') as file:
+            attributes = json.load(file)
+        name = attributes.pop('array')
+        extra = attributes.pop('extra')
+
+        return Sequence.from_attributes(attributes, name, np.load(file_name + '.npy', mmap_mode='r')), extra
+
+
+class HashHopList:
+    """
+    Hop sequence of a device with a 'lora-e-eu-hash' sequence, the hash of its random number and each hop index.
+    Hops are computed when sliced, a block at a time as devices hop forward, so no maximum number of hops is
+    needed and memory does not grow with the simulation duration.
+    """
+
+    # Number of hops computed at once
+    block_size = 256
+
+    def __init__(self, seed, n_channels, min_ch_dist):
+        """
+        :param seed: n_bits-bit random number of the device
+        :param n_channels: number of channels that the device is allowed to hop to
+        :param min_ch_dist: minimum hop distance in channels
+        """
+        self.seed = seed
+        self.n_ch_available = int(n_channels / min_ch_dist)
+        self.min_ch_dist = min_ch_dist
+
+        # Block of hops computed last and the index of its first hop
+        self.first = 0
+        self.block = np.zeros(0, dtype=int)
+
+    def __getitem__(self, index):
+        """Return the channel of a hop, or the array of channels of a slice of hops [start:stop]."""
+        if not isinstance(index, slice):
+            return int(self[index:index + 1][0])
+
+        start = index.start or 0
+        stop = index.stop
+        if stop is None or index.step not in (None, 1) or start < 0:
+            raise Exception("Hash hop sequences are infinite, only slices [start:stop] can be taken!")
+
+        if start < self.first or stop > self.first + len(self.block):
+            self.first = start
+            self.block = SequenceHelper.SequenceHelper.calc_next_hop_hashes(self.seed,
+                                                                            np.arange(start, max(stop, start + self.block_size)),
+                                                                            self.n_ch_available, self.min_ch_dist)
+        return self.block[start - self.first:stop - self.first]
+
+    def get_channels(self):
+        """Return the channels that the sequence can hop to."""
+        return self.min_ch_dist * np.arange(self.n_ch_available)
+
+
+class CycleHopList:
+    """
+    Hop sequence of a device with a periodic sequence, its cycle repeated without end. Hop i is the hop
+    i % cycle_length of the cycle, so only the cycle is kept however long the simulation runs.
+    """
+
+    def __init__(self, cycle):
+        """
+        :param cycle: array with one period of the sequence
+        """
+        self.cycle = np.asarray(cycle)
+
+    def __getitem__(self, index):
+        """Return the channel of a hop, or the array of channels of a slice of hops [start:stop]."""
+        if not isinstance(index, slice):
+            return int(self.cycle[index % len(self.cycle)])
+
+        start = index.start or 0
+        stop = index.stop
+        if stop is None or index.step not in (None, 1) or start < 0:
+            raise Exception("Periodic hop sequences are infinite, only slices [start:stop] can be taken!")
+
+        return self.cycle[np.arange(start, stop) % len(self.cycle)]
+
+    def get_channels(self):
+        """Return the channels that the sequence can hop to."""
+        return np.unique(self.cycle)
+
 
 
 
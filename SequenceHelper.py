@@ -3,13 +3,42 @@ import zlib
 import numpy as np
 
 
+def get_crc32_table():
+    """Table of the CRC-32 of each byte value, with the reflected polynomial of zlib.crc32"""
+    table = np.arange(256, dtype=np.uint32)
+    for _ in range(8):
+        table = np.where(table & 1, (table >> 1) ^ np.uint32(0xEDB88320), table >> 1).astype(np.uint32)
+    return table
+
+
 class SequenceHelper:
     """
     _seq methods return a matrix of size (n_devices, n_hops) with sequences generated accordingly to method selected
     """
 
+    # CRC-32 of each byte value, to hash arrays of values a byte at a time
+    crc32_table = get_crc32_table()
+
+    # Maximum number of hop values hashed at once
+    hash_block_size = 2**20
+
+    @staticmethod
+    def get_channels(seq_type, n_channels, min_ch_dist):
+        """
+        Channels that sequences of a type can hop to.
+        :param seq_type: the method to generate the hopping sequence
+        :param n_channels: length of the set
+        :param min_ch_dist: minimum hop distance in channels
+        :return: sorted array of channels
+        """
+        if seq_type == 'lora-e-eu-hash':
+            # Hash sequences only use the physical carriers, min_ch_dist channels apart
+            return min_ch_dist * np.arange(int(n_channels / min_ch_dist))
+        else:
+            return np.arange(n_channels)
+
     @staticmethod
-    def lora_e_hash(n_channels, min_ch_dist, n_devices, duration, n_bits):
+    def lora_e_hash(n_channels, min_ch_dist, n_devices, duration, n_bits, rng=np.random):
         """
         LoRa-E random sequences using 32 bit hash function.
         :param n_bits:
@@ -22,20 +51,22 @@ class SequenceHelper:
         hop_seq = np.empty((n_devices, duration), dtype=int)
 
         # n_bits-bit random number for each device
-        ran = SequenceHelper.random_seq(domain=2**n_bits - 1, n_devs=n_devices, dur=1)
+        ran = SequenceHelper.random_seq(domain=2**n_bits - 1, n_devs=n_devices, dur=1, rng=rng)
 
         # number of physical carriers usable for channel hopping
         n_ch_available = int(n_channels / min_ch_dist)
 
-        # Get sequence
-        for device in range(n_devices):
-            for frame in range(duration):
-                hop_seq[device, frame] = SequenceHelper.calc_next_hop_hash(ran[device][0], frame, n_ch_available, min_ch_dist)
+        # Get sequence, hashing blocks of devices at once to bound the temporary arrays
+        frames = np.arange(duration)
+        block = max(1, SequenceHelper.hash_block_size // max(duration, 1))
+        for first in range(0, n_devices, block):
+            hop_seq[first:first + block] = SequenceHelper.calc_next_hop_hashes(ran[first:first + block], frames,
+                                                                               n_ch_available, min_ch_dist)
 
         return hop_seq
 
     @staticmethod
-    def lora_e_random_seq_limited(cycle_length, n_channels, min_ch_dist, n_devices, duration):
+    def lora_e_random_seq_limited(cycle_length, n_channels, min_ch_dist, n_devices, duration, rng=np.random):
         """
         Random sequences with minimum hop distance limited to sets of cycle_length.
         :param min_ch_dist: minimum hop distance in channels
@@ -46,18 +77,14 @@ class SequenceHelper:
         """
         assert n_channels > min_ch_dist
 
-        # Pre alloc
-        one_cycle = np.empty((n_devices, cycle_length), dtype=int)
-
         # Generate one period of length cycle_length for each node
-        for device in range(n_devices):
-            one_cycle[device] = SequenceHelper.sample_with_minimum_distance(n_channels, min_ch_dist, cycle_length)
+        one_cycle = SequenceHelper.sample_seqs_with_minimum_distance(n_channels, min_ch_dist, cycle_length, n_devices, rng)
 
         # Fit sequence to simulation length
         return SequenceHelper.fit_seq_sim(one_cycle, duration)
 
     @staticmethod
-    def lora_e_random_seq(n_channels, min_ch_dist, n_devices, duration):
+    def lora_e_random_seq(n_channels, min_ch_dist, n_devices, duration, rng=np.random):
         """
         Random sequences with minimum hop distance.
         :param min_ch_dist: minimum hop distance in channels
@@ -67,33 +94,31 @@ class SequenceHelper:
         :return: matrix of size (n_devices, duration) with uniform random integers within range [0, n_channels)
         """
         assert n_channels > min_ch_dist
-        # Pre alloc
-        hop_seq = np.empty((n_devices, duration), dtype=int)
 
-        for device in range(n_devices):
-            hop_seq[device] = SequenceHelper.sample_with_minimum_distance(n_channels, min_ch_dist, duration)
-
-        return hop_seq
+        # Not a cycle, so the last channel does not need to be away from the first one
+        return SequenceHelper.sample_seqs_with_minimum_distance(n_channels, min_ch_dist, duration, n_devices, rng,
+                                                                cyclic=False)
 
     @staticmethod
-    def random_seq(domain, n_devs, dur):
+    def random_seq(domain, n_devs, dur, rng=np.random):
         """
         Random sequences  within range [0, set).
         :param domain: length of the domain
         :param n_devs: number of devices in simulation
         :param dur: maximum number of freq. choices that a device can perform during simulation
+        :param rng: random number generator to draw from
         :return: matrix of size (n_devices, duration) with uniform random integers
         """
-        return np.random.randint(0, domain, (n_devs, dur))
+        return rng.randint(0, domain, (n_devs, dur))
 
     @staticmethod
-    def lfsr_seq(cycle_length, n_channels, n_devices, duration):
+    def lfsr_seq(cycle_length, n_channels, n_devices, duration, rng=np.random):
         """
         Randomly select next channel until cycle_length channels selected, then repeat sequence
         :param cycle_length: sequence period
         """
         # Generate one period of length (2**n_bits) - 1 for each node
-        one_cycle = SequenceHelper.random_seq(n_channels, n_devices, cycle_length)
+        one_cycle = SequenceHelper.random_seq(n_channels, n_devices, cycle_length, rng)
 
         # Fit sequence to simulation length
         return SequenceHelper.fit_seq_sim(one_cycle, duration)
@@ -124,21 +149,8 @@ class SequenceHelper:
         if seq_duration >= sim_duration:
             return seq[:, :sim_duration]
         else:
-            # Pre alloc
-            full_seq = np.empty((n_devices, sim_duration), dtype=int)
-
-            # Get number of repetitions
-            n_cycles = sim_duration // seq_duration
-            last_part_length = sim_duration % seq_duration
-
-            # Repeat until end of simulation
-            for cycle in range(n_cycles):
-                full_seq[:, seq_duration * cycle:seq_duration * (cycle + 1)] = seq
-
-            if last_part_length != 0:
-                full_seq[:, -last_part_length:] = seq[:, :last_part_length]
-
-            return full_seq
+            # Repeat until end of simulation, hop i is hop i % seq_duration of the original seq
+            return seq[:, np.arange(sim_duration) % seq_duration]
 
     @staticmethod
     def shift_left(arr, n=0):
@@ -146,29 +158,54 @@ class SequenceHelper:
         return arr[n::] + arr[:n:]
 
     @staticmethod
-    def sample_with_minimum_distance(domain, step, samples):
+    def sample_with_minimum_distance(domain, step, samples, rng=np.random):
+        """Return one sequence of sample_seqs_with_minimum_distance."""
+        return SequenceHelper.sample_seqs_with_minimum_distance(domain, step, samples, 1, rng)[0]
+
+    @staticmethod
+    def sample_seqs_with_minimum_distance(domain, step, samples, n_seqs, rng=np.random, cyclic=True):
+        """
+        Random sequences within range [0, domain) where consecutive values are at least step apart, drawn for all
+        sequences at once, one position after the other.
+        :param domain: length of the domain
+        :param step: minimum distance between consecutive values
+        :param samples: length of each sequence
+        :param n_seqs: number of sequences
+        :param rng: random number generator to draw from
+        :param cyclic: if the sequences repeat, the last value is also at least step apart from the first one
+        :return: matrix of size (n_seqs, samples)
+        """
         assert step < domain
 
-        seq = np.empty(samples, dtype=int)
-        seq[0] = SequenceHelper.random_seq(domain, 1, 1)[0][0]
+        seq = np.empty((n_seqs, samples), dtype=int)
+        seq[:, 0] = SequenceHelper.random_seq(domain, n_seqs, 1, rng)[:, 0]
 
         for i in range(1, samples):
-            last_freq = seq[i - 1]
-            next_freq = SequenceHelper.random_seq(domain, 1, 1)[0][0]
+            seq[:, i] = SequenceHelper.draw_with_minimum_distance(domain, step, seq[:, i - 1], rng)
 
-            while abs(last_freq - next_freq) < step:
-                next_freq = SequenceHelper.random_seq(domain, 1, 1)[0][0]
+        # Fix last frequency, drawing it again until it is also away from the first one
+        if cyclic and samples > 1:
+            wrap = np.flatnonzero(np.abs(seq[:, -1] - seq[:, 0]) < step)
+            while len(wrap):
+                seq[wrap, -1] = SequenceHelper.draw_with_minimum_distance(domain, step, seq[wrap, -2], rng)
+                wrap = wrap[np.abs(seq[wrap, -1] - seq[wrap, 0]) < step]
 
-            seq[i] = next_freq
+        return seq
 
-        # Fix last frequency
-        first_freq = seq[0]
-        pen_freq = seq[-2]
-        last_freq = seq[-1]
-        while abs(last_freq - first_freq) < step or abs(last_freq - pen_freq) < step:
-            last_freq = SequenceHelper.random_seq(domain, 1, 1)[0][0]
+    @staticmethod
+    def draw_with_minimum_distance(domain, step, last, rng=np.random):
+        """
+        Draw a value within range [0, domain) for each value in last, uniformly among the ones at least step apart
+        from it. A value is drawn among the allowed ones and moved past the excluded range (last - step, last + step).
+        """
+        low = np.maximum(last - step + 1, 0)
+        high = np.minimum(last + step, domain)
+        n_allowed = domain - (high - low)
+        if np.any(n_allowed < 1):
+            raise Exception("No value of the domain is far enough from the last one!")
 
-        return seq
+        draw = rng.randint(0, n_allowed)
+        return np.where(draw < low, draw, draw + high - low)
 
     @staticmethod
     def gen_phy_m_seq(n_devices, n_bits):
@@ -200,6 +237,29 @@ class SequenceHelper:
         channel = min_ch_dist * modulo
         return channel
 
+    @staticmethod
+    def calc_next_hop_hashes(ran_, i_, n_ch, min_ch_dist):
+        """
+        Array version of calc_next_hop_hash, for arrays of random numbers and hop indexes broadcast together
+        """
+        val = np.asarray(ran_, dtype=np.uint64) + np.uint64(2 ** 16) * np.asarray(i_, dtype=np.uint64)
+        hashed = SequenceHelper.my_hash_array(val)
+        modulo = hashed % np.uint32(n_ch)
+        channel = min_ch_dist * modulo.astype(int)
+        return channel
+
+    @staticmethod
+    def my_hash_array(values):
+        """
+        Array version of my_hash, the CRC-32 of the 8 big-endian bytes of each value computed with a byte table
+        """
+        values = np.asarray(values, dtype=np.uint64)
+        crc = np.full(values.shape, 0xffffffff, dtype=np.uint32)
+        for shift in range(56, -8, -8):
+            byte = ((values >> np.uint64(shift)) & np.uint64(0xff)).astype(np.uint32)
+            crc = SequenceHelper.crc32_table[(crc ^ byte) & np.uint32(0xff)] ^ (crc >> np.uint32(8))
+        return crc ^ np.uint32(0xffffffff)
+
     @staticmethod
     def my_hash(value):
         # Define our int to bytes conversion procedure
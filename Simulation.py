@@ -1,60 +1,118 @@
+import heapq
 import logging
+import random
 
 import numpy as np
 
+import IntervalIndex
+import Packet
+import Results
+import RingGrid
+import Sequence
+import TimeHelper
+import Transmission
+import WidebandTrack
+
 logger = logging.getLogger(__name__)
 
 
 class Simulation:
-    # Singleton, only one instance
-    __instance = None
-
+    # A simulation owns its map with the devices, its grid or index and its random number generators, so several
+    # simulations can be created and run one after the other or side by side in the same process
     simulation_map         = None
     simulation_duration    = 0
     simulation_step        = 0
     simulation_channels    = 0
+    simulation_channel_list = None
+    simulation_rows        = None
     simulation_elements    = 0
     simulation_array       = None
-
-    @staticmethod
-    def get_instance():
-        if Simulation.__instance is None:
-            logger.fatal("Simulation class has not been instantiated!")
-            raise Exception("Simulation class has not been instantiated!")
-
-        # Return instance
-        return Simulation.__instance
+    simulation_wideband    = None
+    simulation_index       = None
+    simulation_frames      = None
+    collision_mode         = None
+    streaming_metrics      = False
+    retired_sent           = None
+    retired_coll           = None
+    rng                    = None
+    py_rng                 = None
+    time_seed              = None
 
     # Class initializer
     # simulation_duration: Time to run the simulation (milliseconds)
     # simulation_step:     Time resolution for the simulation (milliseconds)
     # simulation_map:      Map object that contains the devices to be simulated
     # simulation_channels: Number of channels that the simulation has
-    def __init__(self, simulation_duration=1000, simulation_step=1, simulation_channels=1, simulation_map=None):
+    # simulation_channel_list: Channels that the devices can hop to, the grid only has rows for them (all channels
+    #                      if None). CSS frames are placed in a separate wideband track
+    # collision_mode:      How collisions are found, online in a time-frequency grid ('grid'), online in a grid
+    #                      that only keeps a window of one maximum time on air ('ring'), online in an interval
+    #                      index of the frames in flight of each channel ('index') or offline from the complete
+    #                      frame log once all devices have transmitted ('sweep')
+    # streaming_metrics:   Count the packets received and generated during the simulation and discard the frames
+    #                      that can no longer collide, instead of keeping all frames until the end
+    # seed:                Seed of the random number generators, None to seed them from the system
+    # batched_traffic:     Draw the transmission times of each device in blocks from a numpy Generator of its own,
+    #                      spawned from time_seed, instead of one at a time from rng and py_rng
+    def __init__(self, simulation_duration=1000, simulation_step=1, simulation_channels=1, simulation_map=None,
+                 collision_mode='grid', streaming_metrics=False, simulation_channel_list=None, seed=None,
+                 batched_traffic=False):
         assert(simulation_map is not None)
 
-        # Check instance exists
-        if Simulation.__instance is not None:
-            logger.fatal("Simulation class has already been instantiated!")
-            raise Exception("Simulation class has already been instantiated!")
-
-        # Assign instance
-        Simulation.__instance = self
+        # Random number generators of this simulation, to be used by its devices instead of the global ones
+        self.rng    = np.random.RandomState(seed)
+        self.py_rng = random.Random(seed)
+        if batched_traffic:
+            self.time_seed = np.random.SeedSequence(seed)
 
         # Set parameters
         self.simulation_duration = simulation_duration
         self.simulation_step     = simulation_step
         self.simulation_channels = simulation_channels
         self.simulation_map      = simulation_map
+        self.collision_mode      = collision_mode
+        self.streaming_metrics   = streaming_metrics
 
         # The simulation elements that have to be performed, where each element represents a millisecond
         self.simulation_elements = int(self.simulation_duration * self.simulation_step)
 
-        # Create a zero-filled matrix with the number of elements and channels
-        # TODO: initiallize array with custom type of tuple(int,int,int,int), e.g.: np.zeros((2,), dtype=[(int, int, int, int)])
-        self.simulation_array = np.zeros((self.simulation_channels, int(self.simulation_elements)), dtype=object)
+        # Row of the grid of each channel, -1 if the channel can not be used
+        if simulation_channel_list is None:
+            simulation_channel_list = np.arange(self.simulation_channels)
+        self.simulation_channel_list = np.asarray(simulation_channel_list, dtype=int)
+        self.simulation_rows = np.full(self.simulation_channels, -1, dtype=int)
+        self.simulation_rows[self.simulation_channel_list] = np.arange(len(self.simulation_channel_list))
+        simulation_grid_rows = len(self.simulation_channel_list)
+
+        # Every frame transmitted in the simulation, indexed by frame id
+        self.simulation_frames = Packet.FrameTable()
+
+        if self.collision_mode == 'grid':
+            # Create a zero-filled matrix with the number of elements and channels, where each slot holds the
+            # id + 1 of the frame occupying it, 0 if free or -1 if occupied by collided frames
+            self.simulation_array = np.zeros((simulation_grid_rows, int(self.simulation_elements)), dtype=np.int32)
+            wideband_timeline = np.zeros((1, int(self.simulation_elements)), dtype=np.int32)
+            self.simulation_wideband = WidebandTrack.WidebandTrack(wideband_timeline, limit=self.simulation_elements)
+        elif self.collision_mode == 'ring':
+            # The window of the grid depends on the devices, it is created when the simulation runs
+            self.simulation_array = None
+        elif self.collision_mode == 'index':
+            # Frames are placed in the index of their channel, no grid is needed
+            self.simulation_array = None
+            self.simulation_index = IntervalIndex.ChannelIndex(limit=self.simulation_elements)
+        elif self.collision_mode == 'sweep':
+            # Frames are only logged by the devices, no grid is needed
+            self.simulation_array = None
+        else:
+            logger.fatal(f"Unknown collision mode {self.collision_mode}!")
+            raise Exception(f"Unknown collision mode {self.collision_mode}!")
 
-    # Runs the simulation by calling the 'time_step' function of each device
+        if self.streaming_metrics and self.collision_mode == 'sweep':
+            logger.fatal("Streaming metrics need collisions to be found online!")
+            raise Exception("Streaming metrics need collisions to be found online!")
+
+    # Runs the simulation by calling the 'time_step' function of each device at its scheduled times, or by
+    # transmitting at the times of the schedule of all devices if they have streams of transmission times
     def run(self):
         # Get the devices in the map
         simulation_devices = self.simulation_map.get_devices()
@@ -63,18 +121,138 @@ class Simulation:
         logger.info(f"Simulation time step: {self.simulation_step} milliseconds.")
         logger.info(f"Simulation device elements: {len(simulation_devices)} devices.")
         logger.info(f"Simulation channel elements: {self.simulation_channels} channels.")
-        logger.info(f"Simulation total elements: {self.simulation_array.shape}.")
+        logger.info(f"Simulation total elements: {(len(self.simulation_channel_list), self.simulation_elements)}.")
+        logger.info(f"Simulation collision mode: {self.collision_mode}.")
+        logger.info(f"Simulation streaming metrics: {self.streaming_metrics}.")
 
         # Initialize the devices in the map
         for device in simulation_devices:
             device.init()
 
-        # Run the simulation for each time step
-        for time_step in range(self.simulation_elements):
-            # For each time step, execute each device
-            for device in simulation_devices:
-                device.time_step(current_time=time_step,
-                                 maximum_time=self.simulation_elements,
-                                 sim_grid=self.simulation_array,
-                                 device_list=simulation_devices)
+            # The grid has no row for the channels out of the channel list
+            hop_channels = device.hop_list
+            if isinstance(hop_channels, (Sequence.HashHopList, Sequence.CycleHopList)):
+                hop_channels = hop_channels.get_channels()
+            if device.modulation == 'FHSS' and hop_channels is not None and \
+                    not np.isin(hop_channels, self.simulation_channel_list).all():
+                logger.fatal(f"Device {device.get_id()} hops to channels without a row in the simulation grid!")
+                raise Exception(f"Device {device.get_id()} hops to channels without a row in the simulation grid!")
+
+        # Frames can only collide within the longest time on air, the grid window does not need to be any wider
+        if self.collision_mode == 'ring':
+            # +1 as the parts of a frame may add up to 1 ms more than its time on air due to rounding
+            window = max((device.tx_frame_duration_ms for device in simulation_devices), default=0) + 1
+            self.simulation_array = RingGrid.RingGrid(len(self.simulation_channel_list), window,
+                                                      end_time=self.simulation_elements)
+            self.simulation_wideband = WidebandTrack.WidebandTrack(
+                RingGrid.RingGrid(1, window, end_time=self.simulation_elements), limit=self.simulation_elements)
+            logger.info(f"Simulation grid window: {window} milliseconds.")
+
+        # Packets generated and collided by each device whose frames were already discarded
+        if self.streaming_metrics:
+            self.retired_sent = np.zeros(len(simulation_devices))
+            self.retired_coll = np.zeros(len(simulation_devices))
+            min_retire_size = 1024
+            retire_size = min_retire_size
+
+        # Devices with a stream of transmission times have all their transmissions scheduled at once, as they do
+        # not depend on the channel, the others act one after the other from a queue
+        scheduled = all(device.time_stream is not None for device in simulation_devices)
+        if scheduled:
+            events = self.__get_schedule(simulation_devices)
+        else:
+            events = self.__queue_events(simulation_devices)
+
+        minute = 0
+        for current_time, index in events:
+            device = simulation_devices[index]
+
+            # Say something when running
+            while minute <= current_time:
+                print(f'Simulating minute {minute/1000/60} ...')
+                minute = minute + 60000
+
+            # Slots before the current time can not be occupied by new frames
+            if self.collision_mode == 'ring':
+                self.simulation_array.advance(current_time)
+                self.simulation_wideband.timeline.advance(current_time)
+            elif self.collision_mode == 'index':
+                self.simulation_index.advance(current_time)
+
+            # Neither can new frames overlap the frames that ended before it
+            if self.collision_mode in ('grid', 'ring'):
+                self.simulation_wideband.advance(current_time)
+
+            if scheduled:
+                frame_ids = device.send_frame(current_time, self.simulation_frames)
+            else:
+                frame_ids = device.time_step(current_time=current_time,
+                                             maximum_time=self.simulation_elements,
+                                             sim_frames=self.simulation_frames)
+            self.transmit(frame_ids)
+
+            # Every time the frame table doubles, count and discard the frames that ended before now, as new frames
+            # start now or later they can not collide with them anymore
+            if self.streaming_metrics and len(self.simulation_frames) >= retire_size:
+                self.retire_frames(current_time, simulation_devices)
+                retire_size = max(min_retire_size, 2 * len(self.simulation_frames))
+
+        # Settle all collisions at once from the frames logged by the devices
+        if self.collision_mode == 'sweep':
+            Transmission.resolve_collisions(self.simulation_frames, end_time=self.simulation_elements)
+
+    # Yields the scheduled actions of the devices as (time, position of the device), ordered by time and then by
+    # position in the device list so that devices acting at the same millisecond run in the same order as a
+    # per-millisecond loop would. Each device queues its next action once it performed the current one
+    def __queue_events(self, simulation_devices):
+        events = [(device.get_next_time(), index) for index, device in enumerate(simulation_devices)
+                  if device.get_next_time() < self.simulation_elements]
+        heapq.heapify(events)
+
+        # Jump from one scheduled action to the next instead of visiting every device at every time step
+        while events:
+            current_time, index = heapq.heappop(events)
+            yield current_time, index
+
+            # The device keeps its old time if no further action fits within the simulation time
+            next_time = simulation_devices[index].get_next_time()
+            if current_time < next_time < self.simulation_elements:
+                heapq.heappush(events, (next_time, index))
+
+    # Returns all the transmissions of the devices as (time, position of the device), in the same order as
+    # __queue_events, computed at once from their streams of transmission times
+    def __get_schedule(self, simulation_devices):
+        times, indexes = TimeHelper.TimeHelper.get_schedule(
+            first_times     = [device.get_next_time() for device in simulation_devices],
+            time_streams    = [device.time_stream for device in simulation_devices],
+            frame_durations = [device.tx_frame_duration_ms for device in simulation_devices],
+            maximum_time    = self.simulation_elements)
+        logger.info(f"Simulation scheduled transmissions: {len(times)}.")
+        return zip(times.tolist(), indexes.tolist())
+
+    # Places the frames just transmitted, without a grid or index they stay in the frame table until collisions
+    # are resolved
+    def transmit(self, frame_ids):
+        if self.collision_mode in ('grid', 'ring'):
+            Transmission.transmit(frame_ids, self.simulation_array, self.simulation_frames, self.simulation_rows,
+                                  self.simulation_wideband)
+        elif self.collision_mode == 'index':
+            Transmission.transmit_indexed(frame_ids, self.simulation_index, self.simulation_frames)
+
+    # Counts the packets whose frames all ended by the given time and discards them from the frame table
+    def retire_frames(self, current_time, simulation_devices):
+        frame_table = self.simulation_frames
+
+        # Frames are in transmission order, so the ones that ended form a prefix of the table up to the first
+        # frame still on air, cut at the first part of its packet
+        on_air = np.flatnonzero(frame_table.get_column('end_time') > current_time)
+        if len(on_air):
+            n_frames = on_air[0] - frame_table.part_num[on_air[0]]
+        else:
+            n_frames = len(frame_table)
 
+        if n_frames > 0:
+            sent, coll = Results.count_packets(frame_table, simulation_devices, rows=slice(0, n_frames))
+            self.retired_sent = self.retired_sent + sent
+            self.retired_coll = self.retired_coll + coll
+            frame_table.discard(n_frames)
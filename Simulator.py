@@ -2,11 +2,8 @@ import argparse
 import configparser
 import logging
 import os
-import random
 import sys
 
-import numpy as np
-
 import Device
 import Gateway
 import LoraHelper
@@ -26,11 +23,7 @@ config_name = "Simulator"
 config_ext  = ".cfg"
 
 
-def get_options(args=None):
-    # If we don't pass argument list, get from standard input
-    if args is None:
-        args = sys.argv[1:]
-
+def get_parser():
     # Create parameter parser
     parser = argparse.ArgumentParser(description="WiNe Simulator for LoRa/LoRa_E networks.")
 
@@ -46,9 +39,43 @@ def get_options(args=None):
     parser.add_argument("-dra", "--data_rate_lora", default=0, type=int, help="LoRa data rate mode.")
     parser.add_argument("-dre", "--data_rate_lora_e", default=8, type=int, help="LoRa-E data rate mode.")
 
+    return parser
+
+
+def get_options(args=None):
+    # If we don't pass argument list, get from standard input
+    if args is None:
+        args = sys.argv[1:]
+
     # Parse arguments
-    options = parser.parse_args(args)
+    options = get_parser().parse_args(args)
+
+    return set_max_interval(options)
+
+
+def get_job_options(job):
+    """
+    Return the options of a job given as a dict with the fields of get_options, missing ones take defaults. Values
+    are converted as the command line ones, from their text, so a job fails here if one of them is not valid.
+    """
+    parser = get_parser()
+    options = parser.parse_args([])
+
+    unknown = set(job) - set(vars(options))
+    if unknown:
+        raise Exception(f"Unknown job options {sorted(unknown)}!")
+
+    types = {action.dest: action.type for action in parser._actions}
+    for name, value in job.items():
+        try:
+            setattr(options, name, types[name](str(value)) if types[name] is not None else value)
+        except ValueError:
+            raise Exception(f"Invalid job option {name}={value!r}, expected {types[name].__name__}!")
 
+    return set_max_interval(options)
+
+
+def set_max_interval(options):
     if options.t_mode == 'max':
         # We want the file name to contain max when transmitting at max rate, but
         # in fact, the interval during simulation will be the minimun allowed by duty cycle regulation
@@ -57,39 +84,80 @@ def get_options(args=None):
     return options
 
 
-def main(options, dir_name):
+def get_config():
+    """
+    Return the simulation settings of the configuration file, with the defaults of the optional ones and the seed
+    of the random generators, None if the simulation is random
+    """
     # Read the basic simulator configuration
     config = configparser.ConfigParser()
     config_file = config_name + config_ext
     config.read(config_file)
 
+    # Determine if the simulation is random or deterministic
+    is_random = config.getboolean('simulation', 'is_random')
+
+    return {
+        'seed':                  None if is_random else 1714,
+        # Determines the size of the map
+        'map_size_x':            config.getint('simulation', 'map_size_x'),
+        'map_size_y':            config.getint('simulation', 'map_size_y'),
+        # Determines the device position mode
+        'device_position_mode':  config.get('simulation', 'device_position_mode'),
+        # Determines the simulation duration (in milliseconds)
+        'simulation_duration':   config.getint('simulation', 'simulation_duration'),
+        # Determines the simulation step (in milliseconds)
+        'simulation_step':       config.getint('simulation', 'simulation_step'),
+        # Determines how collisions are found
+        'collision_mode':        config.get('simulation', 'collision_mode', fallback='grid'),
+        # Determines if packets are counted during the simulation, discarding the frames that can no longer collide
+        'streaming_metrics':     config.getboolean('simulation', 'streaming_metrics', fallback=False),
+        # Determines if the transmission times are drawn in blocks from a numpy Generator per device
+        'batched_traffic':       config.getboolean('simulation', 'batched_traffic', fallback=False),
+        # Determines the frequency hopping sequence of LoRa-E devices
+        'sequence_type':         config.get('simulation', 'sequence_type', fallback='lora-e-eu-hash'),
+    }
+
+
+def get_cached_metrics(options, config=None):
+    """
+    Return the metrics of an earlier simulation with the same options, configuration, seed and code from the
+    result store, None if there is none
+    """
+    if config is None:
+        config = get_config()
+
+    return Results.load_metrics(SimulatorHelper.get_cache_key(options, config))
+
+
+def main(options, dir_name):
+    # Read the basic simulator configuration
+    config = get_config()
+
     # Create logging object, will append to existing files
     logging_file = options.logging_file + logging_ext
+    if os.path.dirname(logging_file):
+        os.makedirs(os.path.dirname(logging_file), exist_ok=True)
     logging.basicConfig(level=logging_mode, filename=logging_file, filemode='w',
-                        format='%(filename)s:%(lineno)s %(levelname)s: %(message)s')
+                        format='%(filename)s:%(lineno)s %(levelname)s: %(message)s', force=True)
 
     logger.info(f"Starting simulation with parameters = {options}")
-    logger.info(f"Results will be saved in {dir_name}")
+    logger.info(f"Results will be saved in {Results.store_file} as {SimulatorHelper.get_save_file(options, dir_name)}")
 
     # Determine if the simulation is random or deterministic
-    is_random = config.getboolean('simulation', 'is_random')
-    if not is_random:
-        logger.info(f"Running simulation in random mode: {is_random}")
-        np.random.seed(seed=1714)
-        random.seed(1714)
-
-    # Determines the size of the map
-    map_size_x = config.getint('simulation', 'map_size_x')
-    map_size_y = config.getint('simulation', 'map_size_y')
-
-    # Determines the device position mode
-    device_position_mode = config.get('simulation', 'device_position_mode')
-
-    # Determines the simulation duration (in milliseconds)
-    simulation_duration = config.getint('simulation', 'simulation_duration')
-    
-    # Determines the simulation step (in milliseconds)
-    simulation_step = config.getint('simulation', 'simulation_step')
+    seed = config['seed']
+    if seed is not None:
+        logger.info(f"Running simulation in random mode: False, seed = {seed}")
+
+    map_size_x           = config['map_size_x']
+    map_size_y           = config['map_size_y']
+    device_position_mode = config['device_position_mode']
+    simulation_duration  = config['simulation_duration']
+    simulation_step      = config['simulation_step']
+    collision_mode       = config['collision_mode']
+    streaming_metrics    = config['streaming_metrics']
+    batched_traffic      = config['batched_traffic']
+    sequence_type        = config['sequence_type']
 
     # Sets the number of devices, timing mode, transmit interval, payload and DR mode
     device_count        = options.devices
@@ -109,12 +177,22 @@ def main(options, dir_name):
     # Create the map
     simulation_map = Map.Map(size_x=map_size_x, size_y=map_size_y, position_mode=device_position_mode)
 
+    # Only the channels that LoRa-E devices hop to need a row in the simulation grid
+    simulation_channel_list = SimulatorHelper.get_channel_list(parameter_list = param_list_lora_e,
+                                                               num_devices    = device_count_lora_e,
+                                                               seq_type       = sequence_type)
+
     # Create the simulation
     simulation = Simulation.Simulation(simulation_duration = simulation_duration,
                                        simulation_step     = simulation_step,
                                        # try to use LoRa-E frequency resolution for the simulation grid
                                        simulation_channels = param_list_lora_e[1] if device_count_lora_e > 0 else param_list_lora[1],
-                                       simulation_map      = simulation_map)
+                                       simulation_map      = simulation_map,
+                                       collision_mode      = collision_mode,
+                                       streaming_metrics   = streaming_metrics,
+                                       simulation_channel_list = simulation_channel_list,
+                                       seed                = seed,
+                                       batched_traffic     = batched_traffic)
 
     # Create a gateway
     gateway = Gateway.Gateway(uid=0)
@@ -129,7 +207,11 @@ def main(options, dir_name):
                                                   time_mode      = device_time_mode, 
                                                   tx_interval    = device_tx_interval, 
                                                   tx_payload     = device_tx_payload,
-                                                  gateway        = gateway)
+                                                  gateway        = gateway,
+                                                  sim_map        = simulation_map,
+                                                  rng            = simulation.rng,
+                                                  py_rng         = simulation.py_rng,
+                                                  time_seed      = simulation.time_seed)
                                                   
     devices_lora_e = SimulatorHelper.create_devices(parameter_list  = param_list_lora_e, 
                                                     num_devices     = device_count_lora_e, 
@@ -139,7 +221,13 @@ def main(options, dir_name):
                                                     tx_payload      = device_tx_payload, 
                                                     offset_id       = device_count_lora,
                                                     pre_compute_seq = True,
-                                                    sim_duration    = simulation_duration)
+                                                    sim_duration    = simulation_duration,
+                                                    sim_map         = simulation_map,
+                                                    rng             = simulation.rng,
+                                                    py_rng          = simulation.py_rng,
+                                                    time_seed       = simulation.time_seed,
+                                                    seq_type        = sequence_type,
+                                                    reuse_seq       = SimulatorHelper.reuses_sequences(config))
 
     # Add devices to simulation
     for device in devices_lora + devices_lora_e:
@@ -152,17 +240,19 @@ def main(options, dir_name):
     print("Saving ...")
     Results.save_simulation(simulation=simulation, save_sim=False, plot_grid=False)
 
-    # Calculate and save metrics for LoRa and LoRa-E to file
+    # Calculate and save metrics for LoRa and LoRa-E to the result store
     metrics = Results.get_metrics(simulation)
-    np.save(dir_name + str(device_count) + '_' + str(device_tx_interval) + '_' + str(options.run), metrics)
+    Results.store_metrics(SimulatorHelper.get_record(options, config), metrics)
+
+    return metrics
 
 
 if __name__ == "__main__":
     # Get the execute parameters
     options = get_options()
 
-    # Create saving directory if it does not exist
-    dir_name = SimulatorHelper.create_save_dir(options)
+    # Name of the results, which are saved to the result store
+    dir_name = SimulatorHelper.get_save_dir(options)
 
     # Run simulation
     main(options, dir_name)
@@ -1,11 +1,44 @@
+import collections
+import functools
+import glob
+import hashlib
+import json
 import os
+import random
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
 
 import Device
 import Sequence
+import SequenceHelper
+
+# Hop sequences generated by earlier simulations in this process, with the random state before and after drawing
+# them, and the maximum bytes of hop sequences kept
+sequence_cache = collections.OrderedDict()
+sequence_cache_bytes = 2**28
+
+# Hop sequences saved by earlier simulations in any process, memory-mapped when loaded, and the minimum bytes of a
+# hop sequence to save it, smaller ones are drawn again faster than read. Only the seeded simulations with a sequence
+# type drawn in full reuse them, see reuses_sequences
+sequence_dir = './results/sequences/'
+sequence_file_bytes = 2**20
+
+# Hop sequences shared with the other workers of a sweep in named shared memory blocks, if enabled by the sweep
+# driver: the blocks attached by this process, the names of the ones it created and the maximum seconds to wait for
+# a block being written by another process
+shared_sequences = False
+shared_blocks = {}
+created_blocks = []
+shared_block_timeout = 60
 
 
-def create_save_dir(options):
-    """Create a directory to save the results"""
+def get_save_dir(options):
+    """
+    Return the directory that names the results of a simulation, by data rate or percentage and payload. Results
+    are kept in the result store, the directory is not created.
+    """
     if options.percentage == 1:
         dir_name = './results/dr' + str(options.data_rate_lora) + '/pl' + str(options.payload) + '/'
     elif options.percentage == 0:
@@ -13,11 +46,234 @@ def create_save_dir(options):
     else:
         dir_name = './results/p' + str(options.percentage) + '/pl' + str(options.payload) + '/'
 
-    if not os.path.exists(dir_name):
-        os.makedirs(dir_name)
-        
     return dir_name
 
+def get_save_file(options, dir_name):
+    """Return the name of a simulation in dir_name, by its devices, interval and run"""
+    return dir_name + str(options.devices) + '_' + str(options.interval) + '_' + str(options.run)
+
+@functools.lru_cache(maxsize=None)
+def get_code_version():
+    """
+    Return the hash of the simulator source, the modules next to this one. Computed once per process, as a long-lived
+    process keeps running the code it imported even if the files change.
+    """
+    code = hashlib.sha256()
+    for file_name in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '*.py'))):
+        with open(file_name, 'rb') as file:
+            code.update(os.path.basename(file_name).encode() + b'\0' + file.read() + b'\0')
+    return code.hexdigest()
+
+def get_cache_key(options, config):
+    """
+    Return the hash of all that determines the metrics of a simulation: the options but the logging file, the
+    simulation settings with the seed (see Simulator.get_config) and the simulator code. Random simulations have
+    no seed, they are told apart by their run number only, as their files were.
+    """
+    settings = {'options': {name: value for name, value in vars(options).items() if name != 'logging_file'},
+                'config':  config,
+                'code':    get_code_version()}
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+
+def get_record(options, config):
+    """Return the columns of the result store record of a simulation but its metrics, see Results.store_columns"""
+    record = {name: value for name, value in vars(options).items() if name != 'logging_file'}
+    record.update(config)
+    record['code'] = get_code_version()
+    record['key'] = get_cache_key(options, config)
+    return record
+
+def get_channel_list(parameter_list, num_devices, seq_type='lora-e-eu-hash'):
+    """Return the channels that LoRa-E devices can hop to, none if there are no LoRa-E devices"""
+    device_modulation, simulation_channels = parameter_list[:2]
+
+    if device_modulation != 'FHSS' or num_devices == 0:
+        return np.zeros(0, dtype=int)
+
+    return SequenceHelper.SequenceHelper.get_channels(seq_type, simulation_channels, Sequence.Sequence.min_ch_dist_eu)
+
+def reuses_sequences(config):
+    """
+    Return if simulations with the given settings (see Simulator.get_config) reuse the hop sequences drawn by
+    earlier ones, saved to sequence_dir and shared between the workers of a sweep. Only seeded simulations draw the
+    same sequence again, and only the types drawn in full are large, the others are computed as devices hop.
+    """
+    return config['seed'] is not None and config['sequence_type'] not in Sequence.Sequence.lazy_seq_types
+
+def get_sequence_file(parameters, state):
+    """
+    Return the file where the Sequence with the given parameters drawn from a random state is saved, without
+    extension. It is named by the hash of the parameters, the state and the code.
+    """
+    name, keys, position, has_gauss, cached_gaussian = state
+    key_values = {'parameters': parameters,
+                  'state':      [name, keys.tolist(), position, has_gauss, cached_gaussian],
+                  'code':       get_code_version()}
+    key = hashlib.sha256(json.dumps(key_values, sort_keys=True).encode()).hexdigest()
+    return sequence_dir + key
+
+def load_sequence(rng, **parameters):
+    """
+    Return the Sequence with the given parameters drawn from rng saved by an earlier simulation, leaving rng as if
+    it had been drawn, None if there is none.
+    """
+    file_name = get_sequence_file(parameters, rng.get_state())
+    if os.path.isfile(file_name + '.json'):
+        seqs, extra = Sequence.Sequence.load(file_name)
+        name, keys, position, has_gauss, cached_gaussian = extra['state']
+        rng.set_state((name, np.array(keys, dtype=np.uint32), position, has_gauss, cached_gaussian))
+        return seqs
+
+    return None
+
+def set_shared_sequences(enabled):
+    """Enable sharing the large hop sequences of this process with others, see share_sequence"""
+    global shared_sequences
+    shared_sequences = enabled
+
+def get_block_name(file_name):
+    """Return the name of the shared memory block of the Sequence saved to file_name, short enough for any platform"""
+    return 'wine_' + hashlib.sha256(os.path.basename(file_name).encode()).hexdigest()[:24]
+
+def get_block_offset(header_size):
+    """Return where the array of a shared memory block starts, 64-byte aligned after the size and the header"""
+    return -(-(8 + header_size) // 64) * 64
+
+def read_block(block):
+    """
+    Return the Sequence in a shared memory block, as a read-only array in the block, and the random state after
+    drawing it. None if the block is not complete within shared_block_timeout, e.g. if its writer died.
+    """
+    header_size = np.ndarray(1, dtype=np.uint64, buffer=block.buf)
+    start = time.time()
+    while header_size[0] == 0:
+        if time.time() - start > shared_block_timeout:
+            return None
+        time.sleep(0.001)
+
+    header = json.loads(bytes(block.buf[8:8 + int(header_size[0])]))
+    name, keys, position, has_gauss, cached_gaussian = header.pop('state')
+    array_name = header.pop('array')
+    array = np.ndarray(header.pop('shape'), dtype=header.pop('dtype'), buffer=block.buf,
+                       offset=get_block_offset(int(header_size[0])))
+    array.flags.writeable = False
+
+    state = (name, np.array(keys, dtype=np.uint32), position, has_gauss, cached_gaussian)
+    return Sequence.Sequence.from_attributes(header, array_name, array), state
+
+def attach_block(block_name):
+    """Return the Sequence and random state in the shared memory block with the given name, None if there is none"""
+    try:
+        block = shared_memory.SharedMemory(name=block_name)
+    except FileNotFoundError:
+        return None
+
+    shared = read_block(block)
+    if shared is None:
+        block.close()
+    else:
+        shared_blocks[block.name] = block
+    return shared
+
+def attach_sequence(rng, **parameters):
+    """
+    Return the Sequence with the given parameters drawn from rng shared by another process, leaving rng as if it
+    had been drawn, None if there is none.
+    """
+    shared = attach_block(get_block_name(get_sequence_file(parameters, rng.get_state())))
+    if shared is None:
+        return None
+
+    seqs, state = shared
+    rng.set_state(state)
+    return seqs
+
+def share_sequence(seqs, file_name, state):
+    """
+    Copy a Sequence to a new shared memory block and return the Sequence reading the block, or the one in the block
+    of another process that shared it first. The block starts with the size of the header, written last so that
+    other processes only read complete blocks, followed by the header with the random state after drawing it, and
+    the array. Blocks stay until the sweep driver unlinks the ones created, see pop_created_blocks.
+    """
+    attributes, array_name = seqs.get_attributes()
+    array = np.asarray(getattr(seqs, array_name))
+    name, keys, position, has_gauss, cached_gaussian = state
+    header = json.dumps(dict(attributes, array=array_name, dtype=array.dtype.str, shape=array.shape,
+                             state=[name, keys.tolist(), position, has_gauss, cached_gaussian])).encode()
+    offset = get_block_offset(len(header))
+
+    try:
+        block = shared_memory.SharedMemory(name=get_block_name(file_name), create=True, size=offset + array.nbytes)
+    except FileExistsError:
+        shared = attach_block(get_block_name(file_name))
+        return seqs if shared is None else shared[0]
+
+    block.buf[8:8 + len(header)] = header
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf, offset=offset)[...] = array
+    np.ndarray(1, dtype=np.uint64, buffer=block.buf)[0] = len(header)
+
+    shared_blocks[block.name] = block
+    created_blocks.append(block.name)
+    return read_block(block)[0]
+
+def pop_created_blocks():
+    """Return the names of the shared memory blocks created by this process since the last call"""
+    names = list(created_blocks)
+    created_blocks.clear()
+    return names
+
+def unlink_blocks(names):
+    """Remove the shared memory blocks with the given names, the processes attached to them keep their memory"""
+    for name in names:
+        try:
+            block = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            continue
+        block.close()
+        block.unlink()
+
+def get_sequence(rng=np.random, reuse=False, **parameters):
+    """
+    Return the Sequence with the given parameters drawn from rng. If this process drew the same sequence from the
+    same random state before, it is reused and rng is left as if it had been drawn again, so the results do not
+    change. With reuse, see reuses_sequences, large sequences are also saved to sequence_dir and memory-mapped by
+    later processes, and shared with the other workers of a sweep if shared_sequences is enabled.
+    """
+    if not isinstance(rng, np.random.RandomState):
+        return Sequence.Sequence(rng=rng, **parameters)
+
+    state = rng.get_state()
+    name, keys, position, has_gauss, cached_gaussian = state
+    key = (tuple(sorted(parameters.items())), name, keys.tobytes(), position, has_gauss, cached_gaussian)
+    if key in sequence_cache:
+        sequence_cache.move_to_end(key)
+        seqs, after = sequence_cache[key]
+        rng.set_state(after)
+        return seqs
+
+    share = reuse and shared_sequences
+    seqs = attach_sequence(rng, **parameters) if share else None
+    if seqs is None:
+        seqs = load_sequence(rng, **parameters) if reuse else None
+        if seqs is None:
+            seqs = Sequence.Sequence(rng=rng, **parameters)
+            if reuse and seqs.get_nbytes() >= sequence_file_bytes:
+                os.makedirs(sequence_dir, exist_ok=True)
+                name, keys, position, has_gauss, cached_gaussian = rng.get_state()
+                seqs.save(get_sequence_file(parameters, state),
+                          state=[name, keys.tolist(), position, has_gauss, cached_gaussian])
+
+        # Other workers attach to it instead of holding their own copy
+        if share and seqs.get_nbytes() >= sequence_file_bytes:
+            seqs = share_sequence(seqs, get_sequence_file(parameters, state), rng.get_state())
+    sequence_cache[key] = (seqs, rng.get_state())
+
+    # Forget the oldest sequences beyond the memory budget
+    while sum(cached.get_nbytes() for cached, _ in sequence_cache.values()) > sequence_cache_bytes:
+        sequence_cache.popitem(last=False)
+
+    return seqs
+
 def create_devices(
     parameter_list,             # parameters defined by LoRaWAN
     num_devices,
@@ -28,7 +284,13 @@ def create_devices(
     offset_id=0,                # value to start id counter 
     pre_compute_seq=False,      # option to use a pre-computed f.h. sequence or compute it online
     sim_duration=3600000,       # needed to pre-compute the number of hops in advance
-    gateway=None                # the gateway, to compute relative distance and assign a DR
+    gateway=None,               # the gateway, to compute relative distance and assign a DR
+    seq_type='lora-e-eu-hash',  # the method to generate the f.h. sequence
+    sim_map=None,               # the map where devices are placed
+    rng=np.random,              # the numpy random number generator of the simulation
+    py_rng=random,              # the python random number generator of the simulation
+    time_seed=None,             # seed sequence of the transmission times, drawn in blocks per device if given
+    reuse_seq=False             # reuse the f.h. sequences of earlier simulations, see reuses_sequences
 ):
     """
     docstring
@@ -44,25 +306,36 @@ def create_devices(
 
     if data_rate > 7 and pre_compute_seq:
         # LoRa-E needs a frequency hopping pattern that can be pre-computed
-        if tx_interval == 'max':
+        if seq_type in Sequence.Sequence.lazy_seq_types:
+            # hash and periodic sequences are computed as devices hop, see Sequence.HashHopList and CycleHopList
+            max_hops = 0
+        elif tx_interval == 'max':
             # we can use the number of transmissions to pre-allocate memory
             # +++ TODO +++: calculate this exactly
             max_hops = sim_duration / 4000 * hop_duration
         else:
             max_hops = sim_duration / tx_interval * hop_duration
 
-        seqs = Sequence.Sequence(modulation = device_modulation,
-                                n_devices  = num_devices,
-                                n_bits     = 9,
-                                n_channels = simulation_channels,
-                                n_hops     = max_hops,
-                                seq_type   = 'lora-e-eu-hash',
-                                dr         = data_rate)
+        seqs = get_sequence(modulation = device_modulation,
+                            n_devices  = num_devices,
+                            n_bits     = 9,
+                            n_channels = simulation_channels,
+                            n_hops     = max_hops,
+                            seq_type   = seq_type,
+                            dr         = data_rate,
+                            rng        = rng,
+                            reuse      = reuse_seq)
 
     # Create LoRaWAN devices of specific type 
     device_list = []
 
     for device_id in range(num_devices):
+        # Each device draws its transmission times from a stream of its own, keyed by its id
+        time_rng = None
+        if time_seed is not None:
+            time_rng = np.random.default_rng(np.random.SeedSequence(entropy=time_seed.entropy,
+                                                                    spawn_key=(device_id + offset_id,)))
+
         device = Device.Device(device_id      = device_id + offset_id,
                                time_mode      = time_mode,
                                tx_interval    = tx_interval,
@@ -74,7 +347,11 @@ def create_devices(
                                hop_list       = seqs.get_hopping_sequence(device_id) if pre_compute_seq else None,
                                num_rep_header = number_repetitions_header,
                                dr             = data_rate,
-                               gateway        = gateway)
+                               gateway        = gateway,
+                               sim_map        = sim_map,
+                               rng            = rng,
+                               py_rng         = py_rng,
+                               time_rng       = time_rng)
         device_list.append(device)
 
     return device_list
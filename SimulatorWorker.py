@@ -0,0 +1,88 @@
+import argparse
+import contextlib
+import json
+import os
+import socketserver
+import sys
+import time
+
+import Simulator
+import SimulatorHelper
+
+
+def get_options(args=None):
+    # If we don't pass argument list, get from standard input
+    if args is None:
+        args = sys.argv[1:]
+
+    parser = argparse.ArgumentParser(description="Long-lived WiNe Simulator worker, runs the jobs given as JSON lines.")
+    parser.add_argument("-s", "--socket", type=str, default=None,
+                        help="Unix socket to listen on for jobs, jobs are read from standard input if not given.")
+
+    return parser.parse_args(args)
+
+
+def run_job(line):
+    """
+    Run the job in a JSON line and return the JSON line of its result. A job is an object with the fields of
+    Simulator.get_options, defaults are taken for the missing ones, and an optional id returned with the result:
+
+        {"id": 1, "devices": 100, "t_mode": "max", "payload": 10, "percentage": 0, "data_rate_lora_e": 8}
+
+    The result has the id, the metrics tuple, the simulation name and the runtime, or the error if the job failed.
+    Jobs already run under the same configuration and code are not simulated again.
+    """
+    job_id = None
+    try:
+        job = json.loads(line)
+        job_id = job.pop('id', None)
+
+        start = time.time()
+        options = Simulator.get_job_options(job)
+        dir_name = SimulatorHelper.get_save_dir(options)
+
+        # Simulations already run under the same configuration and code are taken from the result cache
+        metrics = Simulator.get_cached_metrics(options)
+        if metrics is None:
+            # The simulation progress goes to stderr, stdout only has results
+            with contextlib.redirect_stdout(sys.stderr):
+                metrics = Simulator.main(options, dir_name)
+
+        result = {'id': job_id,
+                  'metrics': [None if metric is None else float(metric) for metric in metrics],
+                  'name': SimulatorHelper.get_save_file(options, dir_name),
+                  'seconds': time.time() - start}
+    except Exception as error:
+        result = {'id': job_id, 'error': repr(error)}
+
+    return json.dumps(result)
+
+
+class JobHandler(socketserver.StreamRequestHandler):
+    """Runs the jobs sent over a connection, one JSON line each, and answers with their results"""
+
+    def handle(self):
+        for line in self.rfile:
+            if line.strip():
+                self.wfile.write((run_job(line) + '\n').encode())
+                self.wfile.flush()
+
+
+def main(options):
+    if options.socket is None:
+        # Jobs from standard input, results to standard output
+        for line in sys.stdin:
+            if line.strip():
+                print(run_job(line), flush=True)
+    else:
+        # Jobs from the clients connecting to the socket, one after the other
+        if os.path.exists(options.socket):
+            os.remove(options.socket)
+        with socketserver.UnixStreamServer(options.socket, JobHandler) as server:
+            print(f"Waiting for jobs on {options.socket} ...", file=sys.stderr)
+            server.serve_forever()
+
+
+if __name__ == "__main__":
+    # Modules, configuration tables and hop sequences are loaded once and kept between jobs
+    main(get_options())
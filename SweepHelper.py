@@ -0,0 +1,258 @@
+import configparser
+import csv
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import resource_tracker
+
+import LoraHelper
+import Results
+import Simulator
+import SimulatorHelper
+
+# Runtimes of the points already simulated, to refine the cost estimates of later sweeps
+runtime_file = './results/runtimes.csv'
+
+
+def get_args(run, devices, data_rate, payload, interval='max', time_mode='expo', log_file=None):
+    """
+    Return the Simulator arguments of a simulation point, with all the devices of the data rate given. Devices
+    transmit at the maximum rate if interval is 'max', otherwise every interval ms on average with time_mode.
+    """
+    if interval == 'max':
+        args = ['-r', run, '-d', devices, '-tm', 'max', '-pl', payload]
+    else:
+        args = ['-r', run, '-d', devices, '-tm', time_mode, '-t', interval, '-pl', payload]
+
+    # LoRa data rates are 0 to 5, LoRa-E data rates are 8 to 11
+    if data_rate < 8:
+        args = args + ['-p', 1, '-dra', data_rate]
+    else:
+        args = args + ['-p', 0, '-dre', data_rate]
+
+    if log_file is not None:
+        args = args + ['-l', log_file]
+
+    return [str(arg) for arg in args]
+
+def parse_list(value):
+    """Return the items of a comma separated list, where an item start:stop[:step] is a range of integers"""
+    items = []
+    for item in value.split(','):
+        item = item.strip()
+        if ':' in item:
+            items.extend(range(*[int(bound) for bound in item.split(':')]))
+        elif item.lstrip('-').isdigit():
+            items.append(int(item))
+        else:
+            items.append(item)
+    return items
+
+def read_spec(spec_file, sections=None):
+    """
+    Expand the sweeps of a spec file into simulation points. Each section of the file is a sweep over the lists of
+    datarates, payloads, devices and intervals ('max' for the maximum rate), repeated runs times, e.g.
+
+        [dr8_max]
+        runs = 2
+        datarates = 8
+        payloads = 10
+        devices = 1, 11, 101:1001:100
+        intervals = max
+
+    :param spec_file: path of the spec file
+    :param sections: names of the sweeps to expand, all if None
+    :return: list with the Simulator arguments of each point, without duplicates
+    """
+    spec = configparser.ConfigParser()
+    if not spec.read(spec_file):
+        raise Exception("Can not read sweep spec file {}!".format(spec_file))
+
+    points = []
+    seen = set()
+    for section in sections or spec.sections():
+        sweep = spec[section]
+        for datarate in parse_list(sweep.get('datarates')):
+            for payload in parse_list(sweep.get('payloads')):
+                for device in parse_list(sweep.get('devices')):
+                    for interval in parse_list(sweep.get('intervals', 'max')):
+                        for i in range(sweep.getint('runs', 1)):
+                            args = get_args(i, device, datarate, payload, interval=interval,
+                                            time_mode=sweep.get('time_mode', 'expo'))
+                            if tuple(args) not in seen:
+                                seen.add(tuple(args))
+                                points.append(args)
+    return points
+
+def get_frames(args, duration):
+    """
+    Return the number of frames that a simulation point is expected to transmit, as each device transmits a frame
+    every time on air plus off period: devices x duration / (ToA + off period)
+    """
+    options = Simulator.get_options(args)
+    device_count_lora = round(options.percentage * options.devices)
+    device_counts = {options.data_rate_lora: device_count_lora,
+                     options.data_rate_lora_e: options.devices - device_count_lora}
+
+    frames = 0
+    for data_rate, device_count in device_counts.items():
+        modulation, _, tx_rate, _, _, _ = LoraHelper.LoraHelper.get_configuration(data_rate)
+        toa, _, _ = LoraHelper.LoraHelper.get_time_on_air(modulation, tx_rate, options.payload, data_rate)
+        if options.interval == 'max':
+            off_period = LoraHelper.LoraHelper.get_off_period(t_air=toa, dc=0.01)
+        else:
+            off_period = options.interval
+        frames = frames + device_count * duration / (toa + off_period)
+    return frames
+
+def read_runtimes():
+    """
+    Return the recorded frames and runtime (s) of the points already simulated, by point name. Runtimes recorded
+    before the result store are by .npy file, the name of the point with the extension.
+    """
+    runtimes = {}
+    if os.path.isfile(runtime_file):
+        with open(runtime_file, newline='') as file:
+            for point_name, frames, seconds in csv.reader(file):
+                if point_name.endswith('.npy'):
+                    point_name = point_name[:-len('.npy')]
+                runtimes[point_name] = (float(frames), float(seconds))
+    return runtimes
+
+def write_runtime(point_name, frames, seconds):
+    """Record the frames and runtime (s) of a point"""
+    with open(runtime_file, 'a', newline='') as file:
+        csv.writer(file).writerow([point_name, frames, seconds])
+
+def get_costs(points, duration, runtimes):
+    """
+    Return the expected frames and runtime of each point. Points simulated before take their recorded runtime,
+    the others their frames times the seconds per frame recorded in the same results directory (data rate and
+    payload), or in all of them. Without records the runtime is the number of frames, which keeps the order.
+    """
+    # Seconds per frame of each results directory and of all of them
+    totals = {}
+    for point_name, (frames, seconds) in runtimes.items():
+        for key in (os.path.dirname(point_name), None):
+            total_frames, total_seconds = totals.get(key, (0., 0.))
+            totals[key] = (total_frames + frames, total_seconds + seconds)
+
+    costs = []
+    for args in points:
+        point_name = get_point_name(args)
+        frames = get_frames(args, duration)
+        if point_name in runtimes:
+            seconds = runtimes[point_name][1]
+        else:
+            total_frames, total_seconds = totals.get(os.path.dirname(point_name), totals.get(None, (1., 1.)))
+            seconds = frames * total_seconds / max(total_frames, 1.)
+        costs.append((frames, seconds))
+    return costs
+
+def get_point_name(args):
+    """
+    Return the name of a simulation point, by its results directory, devices, interval and run, see
+    SimulatorHelper.get_save_file. It labels the point and keys its recorded runtime.
+    """
+    options = Simulator.get_options(args)
+    return SimulatorHelper.get_save_file(options, SimulatorHelper.get_save_dir(options))
+
+def run_point(args):
+    """
+    Run a simulation point in this process and return its duration in seconds and the names of the shared memory
+    blocks it created
+    """
+    start = time.time()
+    options = Simulator.get_options(args)
+    Simulator.main(options, SimulatorHelper.get_save_dir(options))
+    return time.time() - start, SimulatorHelper.pop_created_blocks()
+
+def run_sweep(points, workers=None):
+    """
+    Run simulation points in a pool of worker processes, each one importing the simulator once and running points
+    one after the other. Points whose results are in the result store are skipped, the others are run from the longest to
+    the shortest expected runtime and their runtime is recorded. Points are reported as they complete and
+    a point that raises is reported as failed without stopping the others. If a worker dies the whole pool is lost,
+    so the points that did not complete are run again each in a process of its own, to only fail the one to blame.
+    If the simulations reuse hop sequences (see SimulatorHelper.reuses_sequences), the large ones are drawn by one
+    worker and shared with the others in shared memory, see SimulatorHelper.get_sequence.
+
+    :param points: list with the Simulator arguments of each point, see get_args
+    :param workers: number of worker processes, all cores if None
+    :return: list with the arguments of the points that failed
+    """
+    # Check if already simulated under the same configuration and code
+    config = Simulator.get_config()
+    pending = []
+    for args in points:
+        options = Simulator.get_options(args)
+        if Simulator.get_cached_metrics(options, config) is not None:
+            print('Skipping test {} as its results are in {} with key {}.'.format(
+                get_point_name(args), Results.store_file, SimulatorHelper.get_cache_key(options, config)))
+        else:
+            pending.append(args)
+
+    # Longest points first, so that no long point is left running alone at the end
+    duration = config['simulation_duration']
+    costs = dict(zip(map(tuple, pending), get_costs(pending, duration, read_runtimes())))
+    pending.sort(key=lambda args: costs[tuple(args)][1], reverse=True)
+
+    workers = workers or os.cpu_count()
+    total = len(pending)
+    print('Running {} tests of {} with {} workers.'.format(total, len(points), workers))
+
+    failed = []
+    done = 0
+
+    # Workers share their large hop sequences in shared memory blocks, which are tracked by this process so that
+    # they are not removed when the worker that created them exits, and unlinked at the end of the sweep
+    pool_options = {}
+    if SimulatorHelper.reuses_sequences(config):
+        resource_tracker.ensure_running()
+        pool_options = {'initializer': SimulatorHelper.set_shared_sequences, 'initargs': (True,)}
+    blocks = []
+
+    try:
+        # All points in a shared pool, then the points lost with it in batches of isolated pools
+        batches = [(pending, False)]
+        while batches:
+            batch, isolated = batches.pop(0)
+            if isolated:
+                pools = [ProcessPoolExecutor(max_workers=1, **pool_options) for _ in batch]
+            else:
+                pools = [ProcessPoolExecutor(max_workers=workers, **pool_options)]
+            try:
+                futures = {pools[k % len(pools)].submit(run_point, args): args for k, args in enumerate(batch)}
+                lost = []
+                for future in as_completed(futures):
+                    args = futures[future]
+                    point_name = get_point_name(args)
+                    try:
+                        elapsed, created = future.result()
+                        blocks.extend(created)
+                    except BrokenProcessPool:
+                        # A worker died, in a shared pool it is unknown which point it was running
+                        if isolated:
+                            failed.append(args)
+                            print('Failed test {}: worker died.'.format(point_name))
+                        else:
+                            lost.append(args)
+                    except Exception as error:
+                        failed.append(args)
+                        print('Failed test {}: {!r}'.format(point_name, error))
+                    else:
+                        done = done + 1
+                        print('Finished test {} in {:.1f} s ({}/{}).'.format(point_name, elapsed, done, total))
+                        write_runtime(point_name, costs[tuple(args)][0], elapsed)
+            finally:
+                for pool in pools:
+                    pool.shutdown()
+
+            if lost:
+                print('A worker died, running again {} tests in isolation.'.format(len(lost)))
+                batches.extend((lost[k:k + workers], True) for k in range(0, len(lost), workers))
+    finally:
+        SimulatorHelper.unlink_blocks(blocks)
+
+    return failed
@@ -4,22 +4,25 @@ import numpy as np
 
 
 class TimeHelper:
+    # Mean offset of the next transmission in each mode, in step times
+    mean_offsets = {"deterministic": 1., "normal": 0.5, "uniform": 0.5, "expo": 1., "naive": 1.}
 
-    # Generates a time with deterministic, normal, uniform, ... distributions
+    # Generates a time with deterministic, normal, uniform, ... distributions, drawn from the numpy rng given or,
+    # for the exponential distribution, from the python py_rng
     @staticmethod
-    def next_time(current_time=None, step_time=None, mode="deterministic"):
+    def next_time(current_time=None, step_time=None, mode="deterministic", rng=np.random, py_rng=random):
         if mode == "deterministic":
             next_time = current_time + step_time
         elif mode == "normal":
-            next_time = current_time + max(step_time * TimeHelper.__normal_distribution(), -1 * current_time)
+            next_time = current_time + max(step_time * TimeHelper.__normal_distribution(rng), -1 * current_time)
         elif mode == "uniform":
-            next_time = current_time + max(step_time * TimeHelper.__uniform_distribution(), -1 * current_time)
+            next_time = current_time + max(step_time * TimeHelper.__uniform_distribution(rng), -1 * current_time)
         elif mode == 'expo':
-            next_time = current_time + TimeHelper.__exponential(1./step_time)
+            next_time = current_time + TimeHelper.__exponential(1./step_time, py_rng)
         elif mode == "naive":
             if current_time == 0:
                 # Warm-up period: select uniformly the start time of transmission
-                next_time = current_time + np.random.randint(0, step_time)
+                next_time = current_time + rng.randint(0, step_time)
             else:
                 # Then, deterministic
                 next_time = current_time + step_time
@@ -30,23 +33,160 @@ class TimeHelper:
 
     # Creates a time uniform distribution
     @staticmethod
-    def __uniform_distribution():
-        t = np.random.uniform(low=0, high=1)
+    def __uniform_distribution(rng):
+        t = rng.uniform(low=0, high=1)
         return t
 
     # Creates a time normal distribution
     @staticmethod
-    def __normal_distribution():
+    def __normal_distribution(rng):
         mean = 0.5
         stddev = 0.5 / 3
-        t = np.random.normal(loc=mean, scale=stddev)
+        t = rng.normal(loc=mean, scale=stddev)
         return t
 
     @staticmethod
-    def __exponential(lambd):
+    def __exponential(lambd, py_rng):
         """Exponential distribution.
         Returned values range from 0 to positive infinity if lambd is positive.
         """
         # lambd = 1./t_avg
-        t = random.expovariate(lambd=lambd)
+        t = py_rng.expovariate(lambd=lambd)
         return t
+
+    # Draws the offsets from the current time of the next transmissions with the same distributions as next_time, from
+    # a numpy Generator, in an array of the given size. The step time can be an array of shape (n_devices, 1) to draw
+    # the offsets of all devices at once as an (n_devices, k) array. The first offsets of the naive mode are only drawn
+    # if first, they are the warm-up period, the next time is then round(max(current_time + offset, 0)) in every mode
+    @staticmethod
+    def draw_offsets(step_time=None, mode="deterministic", size=None, rng=None, first=False):
+        step_time = np.asarray(step_time, dtype=float)
+        if mode == "deterministic":
+            offsets = np.broadcast_to(step_time, size).astype(float)
+        elif mode == "normal":
+            offsets = step_time * rng.normal(loc=0.5, scale=0.5 / 3, size=size)
+        elif mode == "uniform":
+            offsets = step_time * rng.uniform(low=0, high=1, size=size)
+        elif mode == 'expo':
+            offsets = rng.exponential(scale=step_time, size=size)
+        elif mode == "naive":
+            offsets = np.broadcast_to(step_time, size).astype(float)
+            if first:
+                # Warm-up period: select uniformly the start time of transmission, then deterministic
+                offsets[..., 0] = rng.integers(0, offsets[..., 0].astype(np.int64))
+        else:
+            raise Exception("Unknown time mode.")
+
+        return offsets
+
+    # Returns the start times of all the transmissions of a set of devices and the position of the device of each
+    # one, sorted by time and then by position. A device transmits first at its first time, then at the times its
+    # TimeStream gives after each frame ends, until a time does not increase or its frame would not end before
+    # maximum_time, as Device.time_step does. The times are cumulative sums of the offsets of all devices at once,
+    # drawn in rounds of the transmissions each device is expected to make until the end, laid one device after the
+    # other in a flat array, so memory grows with the total number of transmissions. Only the devices whose rounding
+    # differs from next_time are computed one by one
+    @staticmethod
+    def get_schedule(first_times=None, time_streams=None, frame_durations=None, maximum_time=None):
+        first_times = np.asarray(first_times, dtype=np.int64)
+        frame_durations = np.asarray(frame_durations)
+        mean_offsets = np.array([stream.step_time * TimeHelper.mean_offsets[stream.mode] for stream in time_streams],
+                                dtype=float)
+
+        active = np.flatnonzero(first_times < maximum_time)
+        last = first_times[active]
+        times = [last]
+        devices = [active]
+        while len(active):
+            # Enough offsets for most devices to reach the end, the others go on in the next round
+            expected = (maximum_time - last) / np.maximum(frame_durations[active] + mean_offsets[active], 1)
+            counts = np.ceil(expected + 4 * np.sqrt(expected)).astype(np.int64) + 8
+            ends = np.cumsum(counts)
+            starts = ends - counts
+            offsets = np.concatenate([time_streams[index].take(count) for index, count in zip(active, counts)])
+            rows = np.repeat(np.arange(len(active)), counts)
+            toa = frame_durations[active][rows]
+
+            # Times assuming that rounding commutes with adding the integer times, a cumulative sum restarted at each
+            # device, then the rounding of next_time from each previous time, which only differs on ties or float
+            # error
+            steps = toa + np.round(offsets)
+            sums = np.cumsum(steps)
+            candidates = last[rows] + sums - np.repeat(sums[starts] - steps[starts], counts)
+            previous = np.empty_like(candidates)
+            previous[1:] = candidates[:-1]
+            previous[starts] = last
+            exact = np.round(np.maximum(previous + toa + offsets, 0))
+
+            # Each device stops at its first invalid time
+            positions = np.arange(len(exact))
+            invalid = np.where((exact > previous) & (exact + toa < maximum_time), len(exact), positions)
+            stops = np.minimum(np.minimum.reduceat(invalid, starts), ends)
+
+            differs = (exact != candidates) & (positions < stops[rows])
+            for row in np.unique(rows[differs]):
+                time = last[row]
+                for k in range(starts[row], ends[row]):
+                    previous[k] = time
+                    time = round(max(time + toa[k] + offsets[k], 0))
+                    exact[k] = time
+                segment = slice(starts[row], ends[row])
+                invalid = ~((exact[segment] > previous[segment]) & (exact[segment] + toa[segment] < maximum_time))
+                stops[row] = starts[row] + (np.argmax(invalid) if invalid.any() else counts[row])
+
+            # The devices that did not stop need more offsets
+            valid = positions < stops[rows]
+            times.append(exact[valid].astype(np.int64))
+            devices.append(active[rows[valid]])
+            going_on = stops == ends
+            active = active[going_on]
+            last = exact[ends[going_on] - 1].astype(np.int64)
+
+        times = np.concatenate(times)
+        devices = np.concatenate(devices)
+        order = np.lexsort((devices, times))
+        return times[order], devices[order]
+
+
+class TimeStream:
+    """
+    Times of the transmissions of a device, from offsets drawn in blocks from its own numpy Generator and consumed
+    from a cursor, instead of one draw per transmission. The times follow the same distributions as
+    TimeHelper.next_time.
+    """
+    block_size = 256
+
+    def __init__(self, step_time, mode, rng):
+        self.step_time = step_time
+        self.mode = mode
+        self.rng = rng
+        self.drawn = 0
+        self.cursor = 0
+        self.offsets = np.zeros(0)
+
+    def __draw(self):
+        """Draw the next block of offsets once the current one is consumed"""
+        if self.cursor == len(self.offsets):
+            self.offsets = TimeHelper.draw_offsets(self.step_time, self.mode, self.block_size, self.rng,
+                                                   first=self.drawn == 0).tolist()
+            self.drawn = self.drawn + len(self.offsets)
+            self.cursor = 0
+
+    def next_time(self, current_time):
+        """Return the time of the next transmission after current_time, as TimeHelper.next_time"""
+        self.__draw()
+        offset = self.offsets[self.cursor]
+        self.cursor = self.cursor + 1
+        return round(max(current_time + offset, 0))
+
+    def take(self, count):
+        """Return the offsets of the next count transmissions as an array, the same ones next_time would use"""
+        offsets = np.zeros(count)
+        taken = 0
+        while taken < count:
+            self.__draw()
+            part = self.offsets[self.cursor:self.cursor + count - taken]
+            offsets[taken:taken + len(part)] = part
+            self.cursor = self.cursor + len(part)
+            taken = taken + len(part)
+        return offsets
@@ -2,101 +2,198 @@ import numpy as np
 
 
 # Transmit a frame
-def transmit(frames, grid, devices):
+def transmit(frame_ids, grid, frame_table, channel_rows, wideband):
     """
     Given a list of frames. Allocate them in time and frequency space.
 
-    :param devices: list of devices in Simulation
-    :param frames: The list of frames to allocate in freq and time
-    :param grid: The simulation array of size [freq, time],
+    :param frame_ids: The ids of the frames to allocate in freq and time
+    :param grid: The integer simulation array of size [row, time], with one row per channel that can be used,
                     - 0 : the slot is free (not occupied by another frame)
                     - -1 : the slot is occupied by an already collided frames
-                    - str : the slot is occupied by frame with str='owner.number.part'
+                    - n > 0 : the slot is occupied by the frame with id n - 1
                             (so this frame can be marked as collided when trying to place another above it)
+    :param frame_table: table of frames in Simulation
+    :param channel_rows: row of the grid of each channel
+    :param wideband: WidebandTrack where the CSS frames are placed, same values as the grid
     :return:
     """
 
-    for frame in frames:
+    for frame_id in frame_ids:
         # Get where to place
-        freq, start, end = frame.channel, frame.start_time, frame.end_time
-        if frame.modulation == 'CSS':
-            # Broadband transmission, modulation uses all BW of the channel
-            freq = range(grid.shape[0])     
+        row = frame_table.get_row(frame_id)
+        channel, start, end = frame_table.channel[row], frame_table.start_time[row], frame_table.end_time[row]
+        if channel == -1:
+            # Broadband transmission, modulation uses all BW of the channel, so it overlaps the other CSS frames
+            # and any FHSS frame at the same time
+            target_grids = (wideband.timeline[0, start:end], )
+            narrowband_ids = wideband.get_narrowband(start, end)
+        else:
+            # Narrowband transmission, overlaps the frames in its channel and the CSS frames
+            target_grids = (grid[channel_rows[channel], start:end], wideband.timeline[0, start:end])
+            narrowband_ids = np.zeros(0, dtype=int)
 
         # Check for a collision first
-        collided = check_collision(devices, grid, frame, freq, start, end)
+        collided = check_collision(grid, frame_table, frame_id, target_grids, narrowband_ids, channel_rows, wideband)
 
         # Place within grid
         if collided:
-            # TODO: as a tuple(0/1, x, x, x)
             frame_trace = -1
         else:
             # If no collision, frame should be placed with some information to trace it back, so 
             # this frame can be marked as collided when a collision happens later in simulation
-            # TODO: as a tuple(0/1, x, x, x)
-            frame_trace = str(frame.owner) + '.' + str(frame.number) + '.' + str(frame.part_num)
+            frame_trace = frame_id + 1
+
+        place(grid, frame_table, row, frame_trace, channel_rows, wideband)
+        if channel != -1:
+            wideband.add_narrowband(frame_id, start, end)
 
-        grid[freq, frame.start_time:frame.end_time] = frame_trace
+
+def place(grid, frame_table, row, frame_trace, channel_rows, wideband):
+    """Write the trace of the frame in a row of the frame table over its slots, in the grid or the wideband track."""
+    channel, start, end = frame_table.channel[row], frame_table.start_time[row], frame_table.end_time[row]
+    if channel == -1:
+        wideband.timeline[0, start:end] = frame_trace
+    else:
+        grid[channel_rows[channel], start:end] = frame_trace
 
 
-def check_collision(devices, grid, frame, freq, start, end):
+def check_collision(grid, frame_table, frame_id, target_grids, narrowband_ids, channel_rows, wideband):
     """
 
-    :param devices:
     :param grid:
-    :param frame:
-    :param freq:
-    :param start:
-    :param end:
+    :param frame_table:
+    :param frame_id:
+    :param target_grids: slots of the grid and of the wideband track overlapped by the frame
+    :param narrowband_ids: ids of the FHSS frames overlapped by the frame, when it is a CSS frame
+    :param channel_rows: row of the grid of each channel
+    :param wideband:
     :return:
 
     TODO:
         + Define a minimum frame overlap in Time domain to consider a collision
         + Define a minimum frame overlap in Frequency domain to consider a collision (needs freq resolution)
     """
-    flattened_target_grid = grid[freq, start:end].reshape(-1)
-    is_one_slot_occupied = np.any(flattened_target_grid)
+    is_one_slot_occupied = len(narrowband_ids) > 0 or any(target_grid.any() for target_grid in target_grids)
     if is_one_slot_occupied:
         # Set this frame as collided
-        frame.collided = 1
+        frame_table.collided[frame_table.get_row(frame_id)] = 1
 
-        # Set the other as collided (only interested in slots containing a string)
-        # Get traceability of frames in slots
-        bool_list_is_str = [isinstance(value, str) for value in flattened_target_grid]
-        str_list_frames = flattened_target_grid[bool_list_is_str]
+        # Set the other as collided (only interested in slots containing a frame id)
+        # There can be more than one slot occupied by same frame and can be more than one frame
+        target_grid = np.concatenate(target_grids)
+        frame_ids_to_trace = np.unique(target_grid[target_grid > 0]) - 1
+
+        # and the FHSS frames not set as collided yet
+        if len(narrowband_ids):
+            narrowband_ids = narrowband_ids[frame_table.collided[narrowband_ids - frame_table.first_id] == 0]
+            frame_ids_to_trace = np.concatenate((frame_ids_to_trace, narrowband_ids))
 
         # Only if the other frame was not set as collided yet
-        if len(str_list_frames) > 0:
-            # There can be more than one slot occupied by same frame and can be more than one frame
-            str_list_frames_to_trace = np.unique(str_list_frames)
-
-            for frame_trace in str_list_frames_to_trace:
-                owner, number, part = frame_trace.split('.')
-
-                # Get list of frames txed by device
-                device_frame_list = devices[int(owner)].pkt_list
-
-                # Look up for the first frame that matches the id
-                # NOTE: pkt number can be repeated because it was split into several (FHSS)
-                frame_index = None
-                for i, frame in enumerate(device_frame_list):
-                    if frame.number == int(number):
-                        frame_index = i
-                        break
-                # must be somewhere
-                assert frame_index is not None      
-
-                # Set the corresponding PART to collided
-                device_frame_list[frame_index + int(part)].collided = 1
-                
-                # Set the frame collided to -1 in grid
-                if frame.modulation == 'CSS':
-                    # frame occupies all channels
-                    freq = range(grid.shape[0]) 
-                elif frame.modulation == 'FHSS':
-                    # occupies same channel than the other frame
-                    grid[freq, frame.start_time:frame.end_time] = -1
+        for other_id in frame_ids_to_trace:
+            other_row = frame_table.get_row(other_id)
+            frame_table.collided[other_row] = 1
+
+            # Set the frame collided to -1 in grid
+            place(grid, frame_table, other_row, -1, channel_rows, wideband)
 
     else:
-        frame.collided = 0
+        frame_table.collided[frame_table.get_row(frame_id)] = 0
     return is_one_slot_occupied
+
+
+def transmit_indexed(frame_ids, channel_index, frame_table):
+    """
+    Given a list of frames, place them in the interval index of their channel. Same as transmit, but the frames
+    overlapping each one are looked up in the index instead of in the slots of a grid.
+
+    :param frame_ids: The ids of the frames to place
+    :param channel_index: ChannelIndex with the frames in flight
+    :param frame_table: table of frames in Simulation
+    :return:
+    """
+
+    for frame_id in frame_ids:
+        row = frame_table.get_row(frame_id)
+        channel, start, end = frame_table.channel[row], frame_table.start_time[row], frame_table.end_time[row]
+
+        # Any frame overlapping is a collision, marked on both frames
+        other_ids = channel_index.get_overlapping(channel, start, end)
+        if len(other_ids):
+            frame_table.collided[row] = 1
+            frame_table.collided[other_ids - frame_table.first_id] = 1
+        else:
+            frame_table.collided[row] = 0
+
+        channel_index.add(frame_id, channel, start, end)
+
+
+def resolve_collisions(frame_table, end_time=None):
+    """
+    Given the frame table of a finished simulation, set as collided every frame that overlaps another frame in time
+    and frequency. This gives the same result as placing the frames one by one in the grid, but sorting the frames
+    by time costs O(F log F) and no memory depends on the simulation duration.
+
+    :param frame_table: table of frames in Simulation
+    :param end_time: end of the simulation, the frames are cut at it as the grid has no slots after it
+    :return:
+    """
+    if not len(frame_table):
+        return
+
+    channel = frame_table.get_column('channel').astype(np.int64)
+    start = frame_table.get_column('start_time')
+    end = frame_table.get_column('end_time')
+    if end_time is not None:
+        start = np.minimum(start, end_time)
+        end = np.minimum(end, end_time)
+    collided = np.zeros(len(frame_table), dtype=bool)
+
+    # Frames cut to nothing can not collide, the others are swept
+    kept = np.flatnonzero(start < end)
+    channel, start, end = channel[kept], start[kept], end[kept]
+    is_css = channel == -1
+    collided_kept = np.zeros(len(kept), dtype=bool)
+
+    # CSS frames occupy the whole band, so they collide with any other frame overlapping in time
+    order = np.argsort(start, kind='stable')
+    collided_kept[order] = sweep_overlaps(start[order], end[order])
+    collided_kept &= is_css
+
+    # FHSS frames collide with the frames that overlap in time in the same channel. Channels are laid one after
+    # the other along the time axis so a single sort and sweep covers all of them
+    fhss = np.flatnonzero(~is_css)
+    order = fhss[np.lexsort((start[fhss], channel[fhss]))]
+    channel_offset = channel[order] * (end.max(initial=0) + 1)
+    collided_kept[order] = sweep_overlaps(start[order] + channel_offset, end[order] + channel_offset)
+
+    # ... and with any CSS frame overlapping in time
+    css = np.flatnonzero(is_css)
+    if len(css) and len(fhss):
+        css = css[np.argsort(start[css], kind='stable')]
+        css_reach = np.maximum.accumulate(end[css])
+        n_css_before_end = np.searchsorted(start[css], end[fhss], side='left')
+        hit = n_css_before_end > 0
+        hit[hit] = css_reach[n_css_before_end[hit] - 1] > start[fhss][hit]
+        collided_kept[fhss] |= hit
+
+    collided[kept] = collided_kept
+    frame_table.get_column('collided')[:] = collided
+
+
+def sweep_overlaps(start, end):
+    """
+    Flag the intervals [start, end) that overlap any other interval of the set.
+
+    :param start: start times, sorted in ascending order
+    :param end: end times
+    :return: boolean array, True if the interval overlaps another one
+    """
+    overlaps = np.zeros(len(start), dtype=bool)
+    if len(start) > 1:
+        # Starts before an earlier interval has ended
+        reach = np.maximum.accumulate(end)
+        overlaps[1:] |= start[1:] < reach[:-1]
+
+        # Ends after the next interval has started
+        overlaps[:-1] |= start[1:] < end[:-1]
+    return overlaps
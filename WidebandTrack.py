@@ -0,0 +1,73 @@
+import numpy as np
+
+
+class WidebandTrack:
+    """
+    Occupancy of the CSS frames, which use the whole band, kept apart from the channel rows of the simulation grid.
+    CSS frames are placed in a single timeline of size [1, time], so a FHSS frame only has to look at one more row.
+    A CSS frame looks up the FHSS frames overlapping it in time as intervals, instead of checking every channel row.
+    FHSS frames are logged as they are transmitted and dropped once they ended, so the log only holds frames in
+    flight, and cleaned up against the current time of the simulation before it grows. As the timeline, the log ends
+    at the time limit, the parts of the frames past the end of the simulation are not logged or looked up.
+    """
+
+    def __init__(self, timeline, capacity=1024, limit=None):
+        self.timeline = timeline    # the [1, time] array, a numpy array or a RingGrid
+        self.limit = limit          # end of the timeline, unlimited if None
+        self.time = 0               # current time of the simulation, frames ended before it are dropped
+        self.size = 0
+        self.capacity = capacity
+        self.frame_ids = np.zeros(self.capacity, dtype=np.int64)
+        self.start_time = np.zeros(self.capacity, dtype=np.int64)
+        self.end_time = np.zeros(self.capacity, dtype=np.int64)
+
+    def __clip(self, start, end):
+        """Return [start, end) cut at the end of the timeline."""
+        if self.limit is None:
+            return start, end
+        return min(start, self.limit), min(end, self.limit)
+
+    def __drop(self, time):
+        """Drop the frames that ended before time."""
+        keep = np.flatnonzero(self.end_time[:self.size] > time)
+        for name in ('frame_ids', 'start_time', 'end_time'):
+            column = getattr(self, name)
+            column[:len(keep)] = column[keep]
+        self.size = len(keep)
+
+    def advance(self, current_time):
+        """Move to current_time, no frame transmitted from now on can overlap the frames that ended before it."""
+        self.time = max(self.time, current_time)
+
+    def add_narrowband(self, frame_id, start, end):
+        """Log a FHSS frame transmitted over [start, end)."""
+        start, end = self.__clip(start, end)
+
+        # Drop the frames that ended when the log is full, and only grow it if it is still more than half full
+        if self.size == self.capacity:
+            self.__drop(self.time)
+            if 2 * self.size >= self.capacity:
+                self.capacity = 2 * self.capacity
+                for name in ('frame_ids', 'start_time', 'end_time'):
+                    column = np.zeros(self.capacity, dtype=np.int64)
+                    column[:self.size] = getattr(self, name)[:self.size]
+                    setattr(self, name, column)
+
+        self.frame_ids[self.size] = frame_id
+        self.start_time[self.size] = start
+        self.end_time[self.size] = end
+        self.size = self.size + 1
+
+    def get_narrowband(self, start, end):
+        """
+        Return the ids of the FHSS frames that overlap [start, end) in time. Queries must come in increasing start
+        order, the frames that ended before start are dropped as they can not overlap later queries either.
+        """
+        start, end = self.__clip(start, end)
+
+        # Drop the frames that ended once the log is half full, so that the cost is amortized
+        if 2 * self.size >= self.capacity:
+            self.__drop(start)
+
+        overlap = (self.start_time[:self.size] < end) & (self.end_time[:self.size] > start)
+        return self.frame_ids[:self.size][overlap]
@@ -6,8 +6,11 @@ from matplotlib import rcParams
 rcParams.update({'figure.autolayout': True})
 
 # load grid
-dvs = np.load('scripts/plots/devices.npy', allow_pickle=True)
-grid = np.load('scripts/plots/grid.npy', allow_pickle=True)
+pkts = np.load('scripts/plots/frames.npy')
+grid = np.load('scripts/plots/grid.npy')
+
+# The grid only has rows for the channels in use, the plot shows all the LoRa-E DR8 channels
+n_channels = 280
 
 lora_pkt_t = 991
 lora_pkt_start = 700
@@ -19,41 +22,39 @@ plt.rc('font', family='serif')
 
 # The plot
 fig, ax = plt.subplots(1)
-ax.plot(0, grid.shape[0])
+ax.plot(0, n_channels)
 ax.plot(3000, 0)
-for device in dvs:
-    pkts = device.pkt_list
-    for pkt in pkts:
-        start = pkt.start_time
-        end = pkt.end_time
-        freq = pkt.channel
-        width = end - start
-        if start >= lora_pkt_start - pkt.duration and end <= lora_pkt_end + pkt.duration:
-            # overlap with SF12 pkt
-            pkt.collided = 1
-        if pkt.collided:
-            color = 'red'
+for pkt in pkts:
+    start = pkt['start_time']
+    end = pkt['end_time']
+    freq = pkt['channel']
+    width = end - start
+    if start >= lora_pkt_start - width and end <= lora_pkt_end + width:
+        # overlap with SF12 pkt
+        pkt['collided'] = 1
+    if pkt['collided']:
+        color = 'red'
+    else:
+        height = 0
+        if pkt['owner'] == 0:
+            color = 'k'
         else:
-            height = 0
-            if pkt.owner == 0:
-                color = 'k'
-            else:
-                color = 'royalblue'
-        rect = patches.Rectangle((start, freq), width, height,
-                                 linewidth=1, linestyle='-', edgecolor=color, facecolor=color, fill=True,
-                                 alpha=None, antialiased=False)
-        ax.add_patch(rect)
+            color = 'royalblue'
+    rect = patches.Rectangle((start, freq), width, height,
+                             linewidth=1, linestyle='-', edgecolor=color, facecolor=color, fill=True,
+                             alpha=None, antialiased=False)
+    ax.add_patch(rect)
 
 # SF 12 lora packet
-rect = patches.Rectangle((lora_pkt_start, 0), lora_pkt_t, grid.shape[0], label=r'LoRa device 3', linewidth=1, edgecolor='grey',
+rect = patches.Rectangle((lora_pkt_start, 0), lora_pkt_t, n_channels, label=r'LoRa device 3', linewidth=1, edgecolor='grey',
                          facecolor='darkgrey', fill=True, alpha=0.5)
 ax.add_patch(rect)
 
 ax.set_xlabel(r'Time (sec)', fontsize=16)
 ax.set_ylabel(r'Channel frequency (MHz)', fontsize=16)
 ax.set_xlim(0, 3800)
-ax.set_ylim(0, grid.shape[0])
-ax.set_yticks([0, grid.shape[0]/2, grid.shape[0]])
+ax.set_ylim(0, n_channels)
+ax.set_yticks([0, n_channels/2, n_channels])
 ax.set_yticklabels(['868.031', '868.1', '868.168'], fontsize=14)
 ax.set_xticks(range(0, grid.shape[1], 1000))        # choose which x locations to have ticks
 ax.set_xticklabels(range(0, 4, 1), fontsize=14)     # set the labels to display at those ticks
@@ -2,6 +2,8 @@ import matplotlib.pyplot as plt
 import numpy as np
 from matplotlib import rcParams
 
+import Results
+
 rcParams.update({'figure.autolayout': True})
 plt.rc('text', usetex=True)
 plt.rc('font', family='serif')
@@ -12,41 +14,28 @@ plt.rcParams["axes.prop_cycle"] = plt.cycler("color", plt.cm.viridis(np.linspace
 # ------------------------------------------
 # Received vs number of devices
 # Maximum transmission rate
-def get_rxed_gen_devices(_path, _devices_num, _runs):
-    generated = []
-    received = []
-    devices = []
-    for device in _devices_num:
-        data_runs = np.empty((len(runs), 2), dtype=float)
-        data_runs[:] = np.nan
-        skip = 0
-        for run in _runs:
-            try:
-                full_path = _path + str(device) + '_max_' + str(run) + '.npy'
-                data_runs[run] = np.load(full_path)
-                print(full_path)
-            except:
-                skip = skip + 1
-        if skip < len(_runs):
-            devices.append(device)
-            generated.append(np.nanmean(data_runs[:, 1]))
-            received.append(np.nanmean(data_runs[:, 0]))
-    return np.array(received), np.array(generated), np.array(devices)
-
-
-# Load data
+def get_rxed_gen_devices(_means, _dr, _devices_num):
+    # Received and generated packets per device averaged over runs, for the numbers of devices simulated
+    groups, received, generated = Results.get_data_rate_metrics(_means, _dr)
+    simulated = np.isin(groups['devices'], _devices_num)
+    return received[simulated], generated[simulated], groups['devices'][simulated]
+
+
+# Load data, all the runs at maximum rate at once
 runs = range(10)
+records = Results.read_metrics(payload=10, t_mode='max', run=runs)
+means = Results.mean_over_runs(records, ('percentage', 'data_rate_lora', 'data_rate_lora_e', 'devices'))
 devices_num = range(1, 1011, 10)
-rxed_dr0_pl10, gen_dr0_pl10, devices_dr0_pl10 = get_rxed_gen_devices('results/dr0/pl10/', devices_num, runs)
-rxed_dr1_pl10, gen_dr1_pl10, devices_dr1_pl10 = get_rxed_gen_devices('results/dr1/pl10/', devices_num, runs)
-rxed_dr2_pl10, gen_dr2_pl10, devices_dr2_pl10 = get_rxed_gen_devices('results/dr2/pl10/', devices_num, runs)
-rxed_dr3_pl10, gen_dr3_pl10, devices_dr3_pl10 = get_rxed_gen_devices('results/dr3/pl10/', devices_num, runs)
-rxed_dr4_pl10, gen_dr4_pl10, devices_dr4_pl10 = get_rxed_gen_devices('results/dr4/pl10/', devices_num, runs)
-rxed_dr5_pl10, gen_dr5_pl10, devices_dr5_pl10 = get_rxed_gen_devices('results/dr5/pl10/', devices_num, runs)
+rxed_dr0_pl10, gen_dr0_pl10, devices_dr0_pl10 = get_rxed_gen_devices(means, 0, devices_num)
+rxed_dr1_pl10, gen_dr1_pl10, devices_dr1_pl10 = get_rxed_gen_devices(means, 1, devices_num)
+rxed_dr2_pl10, gen_dr2_pl10, devices_dr2_pl10 = get_rxed_gen_devices(means, 2, devices_num)
+rxed_dr3_pl10, gen_dr3_pl10, devices_dr3_pl10 = get_rxed_gen_devices(means, 3, devices_num)
+rxed_dr4_pl10, gen_dr4_pl10, devices_dr4_pl10 = get_rxed_gen_devices(means, 4, devices_num)
+rxed_dr5_pl10, gen_dr5_pl10, devices_dr5_pl10 = get_rxed_gen_devices(means, 5, devices_num)
 devices_num = [1, 11, 101, 201, 401, 601, 801, 1001, 1501, 2001, 2501, 3001, 3501, 4000, 4500, 5000, 5500, 6000,
                6500, 7000, 7500, 8000, 10000]
-rxed_dr8_pl10, gen_dr8_pl10, devices_dr8_pl10 = get_rxed_gen_devices('results/dr8/pl10/', devices_num, runs)
-rxed_dr9_pl10, gen_dr9_pl10, devices_dr9_pl10 = get_rxed_gen_devices('results/dr9/pl10/', devices_num, runs)
+rxed_dr8_pl10, gen_dr8_pl10, devices_dr8_pl10 = get_rxed_gen_devices(means, 8, devices_num)
+rxed_dr9_pl10, gen_dr9_pl10, devices_dr9_pl10 = get_rxed_gen_devices(means, 9, devices_num)
 
 # Metric to plot in Y-axis
 metric = 1
@@ -1,48 +1,25 @@
 import matplotlib.pyplot as plt
 import numpy as np
 
+import Results
+
 
 # # ------------------------------------------
 # Generated vs Received
 
 
-def get_rxed_gen_lambda(_path, _tx_intervals, _runs, _num_devs, _dr):
-    _path = _path + str(_num_devs) + '_'
-    generated = []
-    received = []
-    intervals = []
-    for interval in _tx_intervals:
-        data_runs = np.zeros((len(runs), 2), dtype=float)
-        for run in _runs:
-            try:
-                full_path = _path + str(interval) + '_' + str(run) + '.npy'
-                data_runs[run] = np.load(full_path)
-                print(full_path)
-                skip = False
-            except:
-                skip = True
-        if not skip:
-            intervals.append(interval)
-            generated.append(data_runs[:, 1].mean())
-            received.append(data_runs[:, 0].mean())
-    try:
-        if _dr == 0:
-            interval = 98132
-        elif _dr == 8:
-            interval = 267667
-        elif _dr == 9:
-            interval = 0
-        else:
-            pass
-        for run in _runs:
-            data_runs[run] = np.load('results/dr' + str(_dr) + '/pl10/' + str(_num_devs) + '_' + str(interval) + '_' + str(run) + '.npy')
-        intervals.append(interval)
-        generated.append(data_runs[:, 1].mean())
-        received.append(data_runs[:, 0].mean())
-    except:
-        print('Last not found')
-
-    return np.array(received) * _num_devs, np.array(generated) * _num_devs, 3600000. / np.array(intervals)
+def get_rxed_gen_lambda(_means, _tx_intervals, _num_devs, _dr):
+    if _dr == 0:
+        interval = 98132
+    elif _dr == 8:
+        interval = 267667
+    else:
+        interval = 0
+    # Received and generated packets of all devices averaged over runs, by decreasing interval (increasing rate)
+    groups, received, generated = Results.get_data_rate_metrics(_means, _dr)
+    simulated = (groups['devices'] == _num_devs) & np.isin(groups['interval'], list(_tx_intervals) + [interval])
+    groups, received, generated = groups[simulated][::-1], received[simulated][::-1], generated[simulated][::-1]
+    return received * _num_devs, generated * _num_devs, 3600000. / groups['interval']
 
 
 # Sim param
@@ -50,11 +27,14 @@ dvs = [100, 1000, 3000, 5000]
 lmbd = np.arange(1, 900, 2)
 tx_intervals = list(np.round(1. / lmbd * 3600000).astype(int))
 
-# Load data
+# Load data, all the runs at a given interval at once
 runs = [0, 1]
-rxed_dr8, gen_dr8, lmbd_dr8 = get_rxed_gen_lambda('results/dr8/pl10/', tx_intervals, runs, dvs[-1], 8)
-rxed_dr9, gen_dr9, lmbd_dr9 = get_rxed_gen_lambda('results/dr9/pl10/', tx_intervals, runs, dvs[-1], 9)
-rxed_dr0, gen_dr0, lmbd_dr0 = get_rxed_gen_lambda('results/dr0/pl10/', tx_intervals, runs, dvs[-1], 0)
+records = Results.read_metrics(payload=10, run=runs)
+records = records[records['t_mode'] != 'max']
+means = Results.mean_over_runs(records, ('percentage', 'data_rate_lora', 'data_rate_lora_e', 'devices', 'interval'))
+rxed_dr8, gen_dr8, lmbd_dr8 = get_rxed_gen_lambda(means, tx_intervals, dvs[-1], 8)
+rxed_dr9, gen_dr9, lmbd_dr9 = get_rxed_gen_lambda(means, tx_intervals, dvs[-1], 9)
+rxed_dr0, gen_dr0, lmbd_dr0 = get_rxed_gen_lambda(means, tx_intervals, dvs[-1], 0)
 
 # The plot
 plt.rc('text', usetex=True)
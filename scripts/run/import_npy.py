@@ -0,0 +1,18 @@
+"""
+Import the .npy files of the simulations run before the result store into it, once
+"""
+import argparse
+
+import Results
+
+parser = argparse.ArgumentParser(description="Import the .npy result files into the result store.")
+parser.add_argument("results_dir", nargs='?', default='./results/', help="Directory with the results directories.")
+parser.add_argument("-s", "--store", default=Results.store_file, help="Result store file.")
+
+if __name__ == "__main__":
+    options = parser.parse_args()
+
+    imported, skipped = Results.import_npy_files(options.results_dir, options.store)
+    for path in skipped:
+        print('Skipped {}: not the name or metrics of a simulation.'.format(path))
+    print('Imported {} files into {}.'.format(imported, options.store))
@@ -6,6 +6,7 @@ import os
 import numpy as np
 
 import DeviceHelper
+import SweepHelper
 
 
 def get_t_off(_dr, _pl):
@@ -25,13 +26,10 @@ def get_t_off(_dr, _pl):
     return DeviceHelper.DeviceHelper.get_off_period(toa, 0.01), toa
 
 
-python = "python3"
-script = "Simulator.py"
-
-result_file = './results/dr{}/pl{}/{}_{}_{}'
-result_ext  = ".npy"
+log_file_name = './results/logs/dr{}_pl{}_{}_{}_{}'
 
 # Sim parameters
+workers = os.cpu_count()                # number of simulations run in parallel
 runs = 2
 datarates = [0, 5, 8, 9]                # 0 to 5 is LoRa; 8 to 11 is LoRa-E
 payloads  = [50]
@@ -39,6 +37,8 @@ devices   = [10, 100, 1000, 3000, 5000]
 lmbd         = np.arange(1, 1000, 2)    # 1 pkt/h/node until 1000, will be limited by 0.01 DC for each data rate
 tx_intervals = list(np.round(1. / lmbd * 3600000).astype(int))  # Conversion to tx interval in simulation units (ms)
 
+# Collect the simulation points
+points = []
 
 # Execute for all datarates
 for datarate in datarates:
@@ -56,19 +56,13 @@ for datarate in datarates:
                     toff, toa = get_t_off(datarate, payload)
                     if interval <= toff:
                         print('Skipping. Transmission interval {} above limit {} by duty cycle.'.format(interval, toff))
-                        interval = toff     # simulator already adds TOA
+                        interval = int(np.ceil(toff))     # simulator already adds TOA, interval is in integer ms
                     # Repeat for number of runs
                     for i in range(runs):
-                        data_file = result_file.format(datarate, payload, device, interval, i) + result_ext
-                        log_file = result_file.format(datarate, payload, device, interval, i)
-                        # Check if already simulated
-                        if os.path.isfile(data_file):
-                            print('Skipping test {} as results already exist!'.format(data_file))
-                        # Execute the simulation by calling the Simulator.py with the appropriate parameters
-                        else:
-                            print('Running test with parameters datarate={}, payload={}, devices={}, runs={}/{}.'.format(
-                                datarate, payload, device, i + 1, runs))
-                            command = "{} {} -r {} -d {} -t {} -pl {} -dr {} -l {}".format(python, script, i, device,
-                                                                                           interval, payload, datarate,
-                                                                                           log_file)
-                            os.system(command)
+                        log_file = log_file_name.format(datarate, payload, device, interval, i)
+                        points.append(SweepHelper.get_args(i, device, datarate, payload, interval=interval,
+                                                           log_file=log_file))
+
+# Execute the simulations in parallel, skipping the ones already simulated
+if __name__ == "__main__":
+    SweepHelper.run_sweep(points, workers=workers)
@@ -0,0 +1,21 @@
+"""
+Run the sweeps of a spec file in parallel, longest simulations first
+"""
+import argparse
+import os
+
+import SweepHelper
+
+parser = argparse.ArgumentParser(description="Run the sweeps of a spec file.")
+parser.add_argument("spec", nargs='?', default='scripts/run/sweeps.cfg', help="Sweep spec file.")
+parser.add_argument("-s", "--sweeps", nargs='*', default=None, help="Sweeps (sections) to run, all if not given.")
+parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(), help="Number of simulations run in parallel.")
+
+if __name__ == "__main__":
+    options = parser.parse_args()
+
+    # Expand the sweeps into simulation points without duplicates
+    points = SweepHelper.read_spec(options.spec, options.sweeps)
+
+    # Execute the simulations in parallel, skipping the ones already simulated
+    SweepHelper.run_sweep(points, workers=options.workers)
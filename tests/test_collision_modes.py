@@ -0,0 +1,50 @@
+import pytest
+
+import Results
+import Simulator
+
+# Seeded simulations whose frames are still on air at the end, so every mode has to cut them as the grid
+config = """[simulation]
+simulation_duration = 60000
+is_random = False
+device_position_mode = normal
+map_size_x = 100000
+map_size_y = 100000
+simulation_step = 1
+collision_mode = {}
+"""
+
+modes = ('grid', 'ring', 'index', 'sweep')
+
+
+def get_collided(tmp_path, monkeypatch, mode, args):
+    """
+    Run a seeded simulation in the given collision mode and return the collided flag of each of its frames.
+    """
+    (tmp_path / 'Simulator.cfg').write_text(config.format(mode))
+    frames = {}
+
+    def get_metrics(simulation):
+        frames['collided'] = simulation.simulation_frames.get_column('collided').copy()
+        return get_metrics.original(simulation)
+
+    get_metrics.original = Results.get_metrics
+    monkeypatch.setattr(Results, 'get_metrics', get_metrics)
+    monkeypatch.setattr(Results, 'store_metrics', lambda *args, **kwargs: None)
+    Simulator.main(Simulator.get_options(args), str(tmp_path) + '/')
+    monkeypatch.undo()
+    monkeypatch.chdir(tmp_path)
+    return frames['collided']
+
+
+@pytest.mark.parametrize('args', [
+    ['-d', '2000', '-p', '0', '-dre', '8', '-tm', 'expo', '-t', '20000'],
+    ['-d', '600', '-p', '0.5', '-dre', '8', '-dra', '0', '-tm', 'expo', '-t', '20000'],
+])
+def test_collision_modes_agree(tmp_path, monkeypatch, args):
+    monkeypatch.chdir(tmp_path)
+    collided = {mode: get_collided(tmp_path, monkeypatch, mode, args) for mode in modes}
+
+    assert collided['grid'].any()
+    for mode in modes[1:]:
+        assert (collided[mode] == collided['grid']).all(), mode
@@ -0,0 +1,75 @@
+import json
+import multiprocessing
+import os
+import time
+from multiprocessing import shared_memory
+
+import pytest
+
+import SimulatorHelper
+import SweepHelper
+
+# Seeded simulations with sequences drawn in full, so every point draws the same sequence and sweep workers share it
+config = """[simulation]
+simulation_duration = 20000
+is_random = False
+device_position_mode = normal
+map_size_x = 100000
+map_size_y = 100000
+simulation_step = 1
+sequence_type = random
+"""
+
+run_point = SweepHelper.run_point
+created_here = []
+
+
+def run_point_reporting(args):
+    """
+    Run a point as SweepHelper.run_point and record the blocks its worker created and attached to so far. Points
+    wait for both workers to start one, so that neither runs them all.
+    """
+    open('worker_{}'.format(os.getpid()), 'w').close()
+    start = time.time()
+    while len([name for name in os.listdir('.') if name.startswith('worker_')]) < 2 and time.time() - start < 10:
+        time.sleep(0.01)
+
+    elapsed, created = run_point(args)
+    created_here.extend(created)
+    with open('blocks_{}.json'.format(os.getpid()), 'w') as file:
+        json.dump({'created': created_here, 'attached': list(SimulatorHelper.shared_blocks)}, file)
+    return elapsed, created
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork', reason="workers need the patched modules")
+def test_sweep_shares_and_unlinks_sequences(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'Simulator.cfg').write_text(config)
+
+    # Every sequence is large enough to be shared
+    monkeypatch.setattr(SimulatorHelper, 'sequence_file_bytes', 1)
+    monkeypatch.setattr(SweepHelper, 'run_point', run_point_reporting)
+
+    points = [SweepHelper.get_args(run, 20, 8, 10) for run in range(6)]
+    assert SweepHelper.run_sweep(points, workers=2) == []
+
+    reports = [json.loads(path.read_text()) for path in tmp_path.glob('blocks_*.json')]
+    created = [name for report in reports for name in report['created']]
+    attached = [name for report in reports for name in report['attached'] if name not in report['created']]
+
+    # One worker created the block of the sequence, another one attached to it
+    assert len(created) == 1
+    assert attached == created
+
+    # The block was unlinked at the end of the sweep
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=created[0])
+
+
+def test_unseeded_sweep_does_not_share(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'Simulator.cfg').write_text(config.replace('is_random = False', 'is_random = True'))
+
+    monkeypatch.setattr(SimulatorHelper, 'sequence_file_bytes', 1)
+    assert SweepHelper.run_sweep([SweepHelper.get_args(0, 20, 8, 10)], workers=1) == []
+    assert not (tmp_path / 'results' / 'sequences').exists()